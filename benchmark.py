@@ -0,0 +1,294 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import statistics
+import subprocess
+import tempfile
+import tracemalloc
+from contextlib import redirect_stdout
+import numpy as np
+import PIL
+from PIL import Image
+
+from blownout import is_image_blowout
+from crop import crop_center
+from blockblack import add_black_corners_to_folder
+from grayscale_to_rgb import convert_grayscale_to_rgb
+from png_to_jpg import convert_png_to_jpg
+from turbulence_emulation import load_image, apply_effects, get_effect_plan, resize_and_tile
+from pair_images import pair_images
+
+# (name, bit depth, mode, extension) of the generated fixtures
+FIXTURE_KINDS = [
+    ('gray8_jpg', 8, 'L', '.jpg'),
+    ('rgb8_jpg', 8, 'RGB', '.jpg'),
+    ('gray8_png', 8, 'L', '.png'),
+    ('rgb8_png', 8, 'RGB', '.png'),
+    ('gray16_png', 16, 'L', '.png'),
+    ('gray16_tif', 16, 'L', '.tif'),
+    ('rgb8_tif', 8, 'RGB', '.tif'),
+]
+
+def synthetic_disc(size, bit_depth=8, mode='L', seed=0):
+    """
+    A full-disc solar frame: limb darkened disc with granulation noise and a few
+    sunspots on a black sky, as a uint8 or uint16 array of shape (size, size) or (size, size, 3).
+    """
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:size, :size].astype(np.float32)
+    radius = 0.42 * size
+    r = np.hypot(yy - size / 2, xx - size / 2) / radius
+    mu = np.sqrt(np.clip(1 - r ** 2, 0, 1))
+    disc = (1 - 0.6 * (1 - mu)) * (r < 1)
+    disc *= 1 + 0.04 * rng.standard_normal((size, size)).astype(np.float32)
+    for _ in range(4):
+        cy, cx = rng.uniform(0.3, 0.7, 2) * size
+        spot_radius = rng.uniform(0.005, 0.02) * size
+        disc *= 1 - 0.7 * np.exp(-((yy - cy) ** 2 + (xx - cx) ** 2) / (2 * spot_radius ** 2))
+
+    max_value = 2 ** bit_depth - 1
+    pixels = np.clip(disc * 0.9 * max_value, 0, max_value).astype(np.uint16 if bit_depth == 16 else np.uint8)
+    if mode == 'RGB':
+        # Hydrogen alpha like tint
+        pixels = np.stack([pixels, (pixels * 0.55).astype(pixels.dtype), (pixels * 0.25).astype(pixels.dtype)], axis=-1)
+    return pixels
+
+def write_fixtures(fixture_dir, sizes):
+    """ Write every fixture kind in every size, return {fixture name: folder containing only that image} """
+    fixtures = {}
+    for size in sizes:
+        for kind, bit_depth, mode, ext in FIXTURE_KINDS:
+            name = f"{kind}_{size}"
+            folder = os.path.join(fixture_dir, name)
+            os.makedirs(folder)
+            image = Image.fromarray(synthetic_disc(size, bit_depth, mode))
+            image.save(os.path.join(folder, 'frame' + ext), **({'quality': 95} if ext == '.jpg' else {}))
+            fixtures[name] = folder
+    return fixtures
+
+def fixture_path(folder):
+    return os.path.join(folder, os.listdir(folder)[0])
+
+def fresh_dir(work_dir, name):
+    path = os.path.join(work_dir, name)
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    return path
+
+def build_cases(fixtures, work_dir):
+    """
+    Benchmark cases as (case name, fixture name, setup) where setup() returns the
+    function to time, so decoding inputs or clearing outputs is not measured.
+    """
+    cases = []
+    for name, folder in sorted(fixtures.items()):
+        path = fixture_path(folder)
+        ext = os.path.splitext(path)[1]
+
+        if ext in ('.jpg', '.png'):
+            cases.append(('is_image_blowout', name, lambda path=path: lambda: is_image_blowout(path)))
+
+        def crop_setup(path=path, ext=ext):
+            width, height = Image.open(path).size
+            output = os.path.join(fresh_dir(work_dir, 'crop'), 'frame' + ext)
+            return lambda: crop_center(path, output, int(width * 0.8), int(height * 0.8))
+        cases.append(('crop_center', name, crop_setup))
+
+        if ext == '.jpg':
+            def corners_setup(folder=folder):
+                output = fresh_dir(work_dir, 'corners')
+                return lambda: add_black_corners_to_folder(folder, output, 260, resume=False)
+            cases.append(('add_black_corners_to_folder', name, corners_setup))
+
+        if ext == '.jpg' and name.startswith('gray8'):
+            def rgb_setup(folder=folder):
+                output = fresh_dir(work_dir, 'rgb')
+                return lambda: convert_grayscale_to_rgb(folder, output, resume=False)
+            cases.append(('convert_grayscale_to_rgb', name, rgb_setup))
+
+            def pair_setup(folder=folder):
+                output = fresh_dir(work_dir, 'pairs')
+                return lambda: pair_images(folder, folder, output, workers=1)
+            cases.append(('pair_images', name, pair_setup))
+
+        if ext == '.png':
+            def png_setup(folder=folder):
+                output = fresh_dir(work_dir, 'png_to_jpg')
+                return lambda: convert_png_to_jpg(folder, output, resume=False, workers=1)
+            cases.append(('convert_png_to_jpg', name, png_setup))
+
+        if ext in ('.jpg', '.tif'):
+            def effects_setup(path=path):
+                image = load_image(path)
+                kernel = np.ones((5, 5)) / 25
+                plan = get_effect_plan((image.height, image.width), 2, 10, 5)
+                return lambda: apply_effects(image, kernel, 2, 10, 0.5, True, True, True, plan)
+            cases.append(('apply_effects', name, effects_setup))
+
+            def tile_setup(path=path):
+                image = load_image(path)
+                return lambda: resize_and_tile(image)
+            cases.append(('resize_and_tile', name, tile_setup))
+    return cases
+
+def _proc_status_bytes(field):
+    """ A memory field of /proc/self/status (Linux) in bytes, or None """
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+
+def reset_peak_rss():
+    """ Restart the VmHWM high-water mark (Linux), so the next peak belongs to the measured run """
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+        return True
+    except OSError:
+        return False
+
+def rss_bytes(peak=True):
+    """
+    Peak (or current) resident set size of this process. On Linux from /proc, because
+    ru_maxrss of a child starts at its parent's peak; elsewhere ru_maxrss (bytes on macOS).
+    """
+    value = _proc_status_bytes('VmHWM' if peak else 'VmRSS')
+    if value is not None:
+        return value
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+def measure_case(fixture_dir, work_dir, case, fixture, repeat):
+    """
+    Run one case in this (fresh) process: one run for the peak RSS, which includes
+    Pillow's C buffers that tracemalloc can't see, one traced for the Python/NumPy
+    peak, then repeat timed runs. rss_growth is the peak over the RSS after setup.
+    """
+    fixtures = {name: os.path.join(fixture_dir, name) for name in os.listdir(fixture_dir)}
+    setup = next(setup for name, fixture_name, setup in build_cases(fixtures, work_dir)
+                 if (name, fixture_name) == (case, fixture))
+    with redirect_stdout(io.StringIO()):
+        function = setup()
+        rss_before = rss_bytes(peak=not reset_peak_rss())
+        function()
+        peak_rss = rss_bytes()
+
+        function = setup()
+        tracemalloc.start()
+        function()
+        python_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        times = []
+        for _ in range(repeat):
+            function = setup()
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+    return {
+        'case': case,
+        'fixture': fixture,
+        'seconds_min': min(times),
+        'seconds_median': statistics.median(times),
+        'repeat': len(times),
+        'python_peak_bytes': python_peak,
+        'peak_rss_bytes': peak_rss,
+        'rss_growth_bytes': peak_rss - rss_before,
+    }
+
+def run_case(fixture_dir, work_dir, case, fixture, repeat):
+    """ measure_case in a child process, so one case's allocations don't inflate the next one's RSS """
+    command = [sys.executable, os.path.abspath(__file__), '--measure', case, fixture, fixture_dir, work_dir, '--repeat', str(repeat)]
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"{case} on {fixture} failed:\n{completed.stderr}")
+    return json.loads(completed.stdout.splitlines()[-1])
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(results, baseline, threshold):
+    """ Print time ratios against a baseline result file, return the keys of regressed cases """
+    previous = {(result['case'], result['fixture']): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        key = (result['case'], result['fixture'])
+        if key not in previous:
+            continue
+        ratio = result['seconds_min'] / max(previous[key]['seconds_min'], 1e-9)
+        flag = '  REGRESSION' if ratio > threshold else ''
+        print(f"{result['case']:<28} {result['fixture']:<18} {ratio:6.2f}x{flag}")
+        if flag:
+            regressions.append(key)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Time and memory-profile the processing scripts on synthetic solar-disc images.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[512, 1835], help="Square fixture sizes in pixels")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per case, after the memory-profiled runs")
+    parser.add_argument('--filter', type=str, default=None, help="Only run cases whose name contains this string")
+    parser.add_argument('--output', type=str, default=None, help="Write the results as JSON to this file")
+    parser.add_argument('--compare', type=str, default=None, help="Compare against a previous JSON result file")
+    parser.add_argument('--threshold', type=float, default=1.2, help="Slowdown ratio reported as a regression")
+
+    parser.add_argument('--measure', nargs=4, default=None, metavar=('CASE', 'FIXTURE', 'FIXTURE_DIR', 'WORK_DIR'), help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+    if args.measure:
+        print(json.dumps(measure_case(args.measure[2], args.measure[3], args.measure[0], args.measure[1], args.repeat)))
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fixture_dir = os.path.join(temp_dir, 'fixtures')
+        fixtures = write_fixtures(fixture_dir, args.sizes)
+        work_dir = os.path.join(temp_dir, 'work')
+        for case, fixture, _ in build_cases(fixtures, work_dir):
+            if args.filter and args.filter not in case:
+                continue
+            result = run_case(fixture_dir, work_dir, case, fixture, args.repeat)
+            results.append(result)
+            print(f"{case:<28} {fixture:<18} {result['seconds_min'] * 1000:9.1f} ms "
+                  f"{result['peak_rss_bytes'] / 2 ** 20:9.1f} MiB RSS (+{result['rss_growth_bytes'] / 2 ** 20:.1f}) "
+                  f"{result['python_peak_bytes'] / 2 ** 20:7.1f} MiB traced")
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pillow': PIL.__version__,
+            'platform': platform.platform(),
+            'sizes': args.sizes,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f"Results saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
+
+#python benchmark.py --sizes 512 1835 4096 --output bench-$(git rev-parse --short HEAD).json --compare bench-baseline.json
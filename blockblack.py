@@ -1,42 +1,78 @@
 from PIL import Image, ImageDraw
 import os
+import argparse
+from manifest import Manifest, atomic_save
+from jpeg_lossless import lossless_available, lossless_black_corners
 
-def add_black_corners_to_folder(input_folder, output_folder, square_size):
+def add_black_corners(img, square_size):
+    # Create a drawing context
+    draw = ImageDraw.Draw(img)
+
+    # Image dimensions
+    width, height = img.size
+
+    # Coordinates for squares
+    coordinates = [
+        (0, 0, square_size, square_size),  # Top-left corner
+        (width - square_size, 0, width, square_size),  # Top-right corner
+        (0, height - square_size, square_size, height),  # Bottom-left corner
+        (width - square_size, height - square_size, width, height)  # Bottom-right corner
+    ]
+
+    # Draw the squares
+    for coord in coordinates:
+        draw.rectangle(coord, fill="black")
+    return img
+
+def add_black_corners_to_folder(input_folder, output_folder, square_size, resume=True, use_hash=False, lossless=False):
     # Ensure output folder exists
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
-    # Process each image in the input folder
-    for filename in os.listdir(input_folder):
-        if filename.lower().endswith('.jpg'):
-            image_path = os.path.join(input_folder, filename)
+    # Only record lossless when jpeglib can deliver it, so installing it later redoes the re-encoded images
+    lossless = lossless and lossless_available(corners=True)
+    params = {'square_size': square_size, 'quality': 95}
+    if lossless:
+        params['lossless'] = True
+
+    # Process each image in the input folder, skipping images done on a previous run
+    with Manifest(output_folder, params, use_hash) as manifest:
+        for filename in os.listdir(input_folder):
+            if filename.lower().endswith('.jpg'):
+                image_path = os.path.join(input_folder, filename)
+                if resume and manifest.is_up_to_date(image_path):
+                    continue
+
+                try:
+                    # Blank the corner blocks in the DCT domain when possible, leaving the rest untouched
+                    if lossless and lossless_black_corners(image_path, os.path.join(output_folder, filename), square_size):
+                        manifest.record(image_path, [filename])
+                        continue
 
-            try:
-                # Open the image
-                with Image.open(image_path) as img:
-                    # Create a drawing context
-                    draw = ImageDraw.Draw(img)
+                    # Open the image
+                    with Image.open(image_path) as img:
+                        add_black_corners(img, square_size)
 
-                    # Image dimensions
-                    width, height = img.size
+                        # Save the image in the output folder
+                        atomic_save(img, os.path.join(output_folder, filename), quality=95)
+                    manifest.record(image_path, [filename])
 
-                    # Coordinates for squares
-                    coordinates = [
-                        (0, 0, square_size, square_size),  # Top-left corner
-                        (width - square_size, 0, width, square_size),  # Top-right corner
-                        (0, height - square_size, square_size, height),  # Bottom-left corner
-                        (width - square_size, height - square_size, width, height)  # Bottom-right corner
-                    ]
+                except Exception as e:
+                    print(f"Error processing {filename}: {e}")
 
-                    # Draw the squares
-                    for coord in coordinates:
-                        draw.rectangle(coord, fill="black")
+def main():
+    parser = argparse.ArgumentParser(description="Paint black squares over the four corners of every JPG in a folder.")
+    parser.add_argument('input_folder', type=str, help="Folder with the JPGs")
+    parser.add_argument('output_folder', type=str, help="Folder for the masked JPGs")
+    parser.add_argument('square_size', type=int, help="Side of the corner squares in pixels")
+    parser.add_argument('--lossless', action='store_true', help="Blank the corners in the DCT domain (jpeglib): no generation loss, squares grown to the 8/16 px grid")
+    parser.add_argument('--no_resume', dest='resume', action='store_false', help="Process all images even if their output is up to date")
+    parser.add_argument('--use_hash', action='store_true', help="Compare file contents, not only size and mtime, when resuming")
 
-                    # Save the image in the output folder
-                    img.save(os.path.join(output_folder, filename), quality=95)
+    args = parser.parse_args()
+    add_black_corners_to_folder(args.input_folder, args.output_folder, args.square_size, args.resume, args.use_hash, args.lossless)
 
-            except Exception as e:
-                print(f"Error processing {filename}: {e}")
+if __name__ == "__main__":
+    main()
 
-# Example usage
-add_black_corners_to_folder("/Users/espensommereide/Developer/solar-dataset/solar-big-bear", "/Users/espensommereide/Developer/solar-dataset/solar-big-bear-black", 260)  # Replace with your paths and square size
+#python blockblack.py /Users/espensommereide/Developer/solar-dataset/solar-big-bear /Users/espensommereide/Developer/solar-dataset/solar-big-bear-black 260
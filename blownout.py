@@ -1,48 +1,94 @@
-from PIL import Image
 import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from PIL import Image
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+def load_rgb_array(image_path, draft_scale=1):
+    """
+    Decode an image into an RGB (or single channel grayscale) uint8 array.
+    :param image_path: Path to the image file.
+    :param draft_scale: Reduction factor (1, 2, 4 or 8) for JPEG draft decoding. Other formats ignore it.
+    :return: Array of shape (height, width, 3) or (height, width) for grayscale images.
+    """
+    with Image.open(image_path) as image:
+        if draft_scale > 1:
+            width, height = image.size
+            image.draft('RGB', (max(1, width // draft_scale), max(1, height // draft_scale)))
+        if image.mode == 'L':
+            # Grayscale has identical channels once converted to RGB, skip the copy
+            return np.asarray(image)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return np.asarray(image)
+
+def white_ratio(pixels, white_threshold=230):
+    """
+    Percentage of pixels where every channel is above white_threshold.
+    :param pixels: Array returned by load_rgb_array.
+    :param white_threshold: The minimum value to consider a pixel 'white'.
+    :return: The white pixel ratio in percent.
+    """
+    white = pixels > white_threshold
+    if white.ndim == 3:
+        white = white.all(axis=2)
+    return (np.count_nonzero(white) / white.size) * 100
 
-def is_image_blowout(image_path, white_threshold=230, blowout_percentage=20):
+def is_image_blowout(image_path, white_threshold=230, blowout_percentage=20, draft_scale=1):
     """
     Check if an image has a high amount of white.
     :param image_path: Path to the image file.
     :param white_threshold: The minimum value to consider a pixel 'white'. Default is 230 (on a scale of 0-255).
     :param blowout_percentage: The percentage of white pixels at which we consider the image 'blown out'.
+    :param draft_scale: Decode JPEGs at 1/draft_scale resolution for an approximate, much faster check.
     :return: True if the image is blown out, False otherwise.
     """
     try:
-        image = Image.open(image_path)
-        if image.mode != 'RGB':
-            # Convert non-RGB images to RGB
-            image = image.convert('RGB')
-        pixels = list(image.getdata())
-        white_pixels = [pixel for pixel in pixels if all(val > white_threshold for val in pixel)]
-        
-        white_ratio = (len(white_pixels) / len(pixels)) * 100
-        return white_ratio > blowout_percentage
+        pixels = load_rgb_array(image_path, draft_scale)
+        return white_ratio(pixels, white_threshold) > blowout_percentage
     except Exception as e:
         print(f"Error processing {image_path}: {e}")
         return False
 
+def list_images(source_dir, extensions=IMAGE_EXTENSIONS):
+    """Sorted list of image filenames in source_dir (checking extension only)."""
+    return [filename for filename in sorted(os.listdir(source_dir)) if filename.lower().endswith(extensions)]
 
-# Define your source directory
-source_dir = '/Volumes/Solardisk/scraper_all_images_flat/testwhite'
-
-# Output file to save the filenames
-output_file = '/Volumes/Solardisk/scraper_all_images_flat/testwhite/not_blown_out_images.txt'
-
-# Get a sorted list of filenames in the source directory
-sorted_filenames = sorted(os.listdir(source_dir))
+def scan_folder(source_dir, output_file, white_threshold=230, blowout_percentage=20, draft_scale=1, workers=None, chunksize=16):
+    """
+    Write the sorted filenames of all images in source_dir that are not blown out to output_file.
+    Images are checked on a process pool; the output keeps the sorted filename order.
+    """
+    filenames = list_images(source_dir)
+    paths = [os.path.join(source_dir, filename) for filename in filenames]
+    check = partial(is_image_blowout, white_threshold=white_threshold, blowout_percentage=blowout_percentage, draft_scale=draft_scale)
 
-# Open the output file in write mode
-with open(output_file, 'w') as file:
-    # Loop through the sorted list of filenames
-    for filename in sorted_filenames:
-        file_path = os.path.join(source_dir, filename)
-        # Check if the file is an image (for simplicity, checking extension only)
-        if file_path.lower().endswith(('.png', '.jpg', '.jpeg')):
-            # If the image is not blown out, write its filename to the file
-            if not is_image_blowout(file_path):
+    with open(output_file, 'w') as file, ProcessPoolExecutor(max_workers=workers) as executor:
+        # map yields results in submission order, so the list stays sorted
+        for filename, blown_out in zip(filenames, executor.map(check, paths, chunksize=chunksize)):
+            if not blown_out:
                 file.write(filename + '\n')
                 print(f'Not blown out image: {filename}')
 
-print(f"List of not blown out images saved to {output_file}")
+    print(f"List of not blown out images saved to {output_file}")
+
+def main():
+    parser = argparse.ArgumentParser(description="List the images in a folder that are not blown out.")
+    parser.add_argument('source_dir', type=str, help="Folder with images to check")
+    parser.add_argument('--output_file', type=str, default=None, help="Output list (default: <source_dir>/not_blown_out_images.txt)")
+    parser.add_argument('--white_threshold', type=int, default=230, help="Minimum value to consider a pixel white")
+    parser.add_argument('--blowout_percentage', type=float, default=20, help="Percentage of white pixels that counts as blown out")
+    parser.add_argument('--draft_scale', type=int, default=1, choices=[1, 2, 4, 8], help="Decode JPEGs at reduced resolution for an approximate check")
+    parser.add_argument('--workers', type=int, default=None, help="Number of worker processes (default: CPU count)")
+
+    args = parser.parse_args()
+    output_file = args.output_file or os.path.join(args.source_dir, 'not_blown_out_images.txt')
+    scan_folder(args.source_dir, output_file, args.white_threshold, args.blowout_percentage, args.draft_scale, args.workers)
+
+if __name__ == "__main__":
+    main()
+
+#python blownout.py /Volumes/Solardisk/scraper_all_images_flat/testwhite
@@ -1,38 +1,73 @@
 from PIL import Image
 import os
+import argparse
+from manifest import Manifest, atomic_save
+from jpeg_lossless import lossless_available, lossless_crop_center
 
-def crop_center(image_path, output_path, new_width=1835, new_height=1835):
-    with Image.open(image_path) as img:
-        width, height = img.size
+def crop_center_image(img, new_width=1835, new_height=1835):
+    width, height = img.size
+
+    # Calculate the left, top, right, and bottom coordinates for the crop
+    left = (width - new_width) / 2
+    top = (height - new_height) / 2
+    right = (width + new_width) / 2
+    bottom = (height + new_height) / 2
 
-        # Calculate the left, top, right, and bottom coordinates for the crop
-        left = (width - new_width) / 2
-        top = (height - new_height) / 2
-        right = (width + new_width) / 2
-        bottom = (height + new_height) / 2
+    # Crop the center of the image
+    return img.crop((left, top, right, bottom))
 
-        # Crop the center of the image
-        img_cropped = img.crop((left, top, right, bottom))
-        img_cropped.save(output_path)
+def crop_center(image_path, output_path, new_width=1835, new_height=1835, lossless=False):
+    # JPEG to JPEG crops can slice the DCT blocks instead, with the crop box snapped to the MCU grid
+    if lossless and lossless_crop_center(image_path, output_path, new_width, new_height):
+        return
 
-def crop_images_in_folder(input_folder, output_folder, new_width=1835, new_height=1835):
+    with Image.open(image_path) as img:
+        img_cropped = crop_center_image(img, new_width, new_height)
+        atomic_save(img_cropped, output_path)
+
+def crop_images_in_folder(input_folder, output_folder, new_width=1835, new_height=1835, resume=True, use_hash=False, lossless=False):
     # Ensure the output folder exists
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
-    for filename in os.listdir(input_folder):
-        print(filename)
-        # Check for image files (You can add or modify the extension based on your needs)
-        if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif', 'tiff', 'tif')):
-            input_path = os.path.join(input_folder, filename)
-            output_path = os.path.join(output_folder, filename)
-            try:
-                crop_center(input_path, output_path, new_width, new_height)
-                print(f"Cropped image saved to {output_path}")
-            except Exception as e:
-                print(f"Error processing {input_path}: {e}")
-
-# Example usage
-input_folder = '/Volumes/Solardisk/sunplanet/040124-lowdisc/timelapse5sec200/pss'  # Change this to your input folder path
-output_folder = '/Volumes/Solardisk/sunplanet/040124-lowdisc/timelapse5sec200/pss-crop'  # Change this to your output folder path
-crop_images_in_folder(input_folder, output_folder)
+    # Only record lossless when a backend can deliver it, so installing one later redoes the re-encoded crops
+    lossless = lossless and lossless_available()
+    params = {'new_width': new_width, 'new_height': new_height}
+    if lossless:
+        params['lossless'] = True
+
+    # Skip images already cropped with the same size on a previous run
+    with Manifest(output_folder, params, use_hash) as manifest:
+        for filename in os.listdir(input_folder):
+            print(filename)
+            # Check for image files (You can add or modify the extension based on your needs)
+            if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif', 'tiff', 'tif')):
+                input_path = os.path.join(input_folder, filename)
+                output_path = os.path.join(output_folder, filename)
+                if resume and manifest.is_up_to_date(input_path):
+                    print(f"Up to date, skipping {output_path}")
+                    continue
+                try:
+                    crop_center(input_path, output_path, new_width, new_height, lossless)
+                    manifest.record(input_path, [filename])
+                    print(f"Cropped image saved to {output_path}")
+                except Exception as e:
+                    print(f"Error processing {input_path}: {e}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Crop the center of every image in a folder.")
+    parser.add_argument('input_folder', type=str, help="Folder with the images to crop")
+    parser.add_argument('output_folder', type=str, help="Folder for the cropped images")
+    parser.add_argument('--width', type=int, default=1835, help="Width of the crop")
+    parser.add_argument('--height', type=int, default=1835, help="Height of the crop")
+    parser.add_argument('--lossless', action='store_true', help="Crop JPEGs in the DCT domain (jpegtran or jpeglib): no generation loss, crop snapped to the 8/16 px grid")
+    parser.add_argument('--no_resume', dest='resume', action='store_false', help="Crop all images even if their output is up to date")
+    parser.add_argument('--use_hash', action='store_true', help="Compare file contents, not only size and mtime, when resuming")
+
+    args = parser.parse_args()
+    crop_images_in_folder(args.input_folder, args.output_folder, args.width, args.height, args.resume, args.use_hash, args.lossless)
+
+if __name__ == "__main__":
+    main()
+
+#python crop.py /Volumes/Solardisk/sunplanet/040124-lowdisc/timelapse5sec200/pss /Volumes/Solardisk/sunplanet/040124-lowdisc/timelapse5sec200/pss-crop --lossless
@@ -0,0 +1,201 @@
+import os
+import sqlite3
+import argparse
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+import numpy as np
+from blownout import list_images
+
+INDEX_FILENAME = 'image_hashes.sqlite'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dhashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash_size INTEGER NOT NULL,
+    hash BLOB NOT NULL
+)
+"""
+
+def dhash(image_path, hash_size=16):
+    """
+    hash_size ** 2 bit difference hash: whether each pixel of a (hash_size + 1) x hash_size
+    grayscale thumbnail is brighter than its left neighbour.
+    JPEGs are draft decoded at reduced resolution, which is all the thumbnail needs.
+    A 9x8 thumbnail of a centered full disc is mostly the limb, so distinct frames
+    get nearly the same 64 bit hash; 16 (256 bits) resolves sunspots and granulation.
+    :return: The hash as an unsigned int, or None if the image can't be read.
+    """
+    try:
+        with Image.open(image_path) as image:
+            image.draft('L', (hash_size * 8, hash_size * 8))
+            thumbnail = image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BOX)
+    except Exception as e:
+        print(f"Error processing {image_path}: {e}")
+        return None
+    pixels = np.asarray(thumbnail, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+def default_radius(hash_size):
+    """
+    Hamming radius for near-duplicates at this hash size. Measured on 256 bit hashes of
+    full-disc frames: resized and re-encoded copies were within 1 bit, different frames
+    8 or more bits apart, so 3 bits, scaled with the number of bits for other sizes.
+    """
+    return max(1, round(3 * hash_size ** 2 / 256))
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+class BKTree:
+    """ Burkhard-Keller tree over hashes, for Hamming radius queries without comparing every pair """
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, value, item):
+        node = self.root
+        if node is None:
+            self.root = (value, item, {})
+            return
+        while True:
+            distance = hamming(value, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (value, item, {})
+                return
+            node = child
+
+    def query(self, value, radius):
+        """ Items whose hash is within radius of value, as (distance, item) """
+        results = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node_value, item, children = stack.pop()
+            distance = hamming(value, node_value)
+            if distance <= radius:
+                results.append((distance, item))
+            # By the triangle inequality only children at distance - radius .. distance + radius can match
+            for child_distance, child in children.items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        return results
+
+class HashIndex:
+    """
+    SQLite sidecar with the dHash of every image, keyed by path relative to the source folder.
+    Entries are reused while the file size, mtime and hash size are unchanged.
+    """
+
+    def __init__(self, source_dir, index_path=None):
+        self.source_dir = source_dir
+        self.index_path = index_path or os.path.join(source_dir, INDEX_FILENAME)
+        self.connection = sqlite3.connect(self.index_path)
+        self.connection.execute(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def update(self, hash_size=16, workers=None, chunksize=64):
+        """
+        Hash new or changed images and drop entries for removed files.
+        :return: Number of images (re)hashed.
+        """
+        filenames = list_images(self.source_dir)
+        known = {path: (size, mtime_ns, known_size) for path, size, mtime_ns, known_size in
+                 self.connection.execute("SELECT path, size, mtime_ns, hash_size FROM dhashes")}
+
+        pending = []
+        for filename in filenames:
+            stat = os.stat(os.path.join(self.source_dir, filename))
+            key = (stat.st_size, stat.st_mtime_ns, hash_size)
+            if known.get(filename) != key:
+                pending.append((filename, key))
+
+        removed = set(known) - set(filenames)
+        self.connection.executemany("DELETE FROM dhashes WHERE path = ?", [(path,) for path in removed])
+
+        paths = [os.path.join(self.source_dir, filename) for filename, _ in pending]
+        compute = partial(dhash, hash_size=hash_size)
+        hash_bytes = -(-hash_size ** 2 // 8)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for (filename, (size, mtime_ns, _)), value in zip(pending, executor.map(compute, paths, chunksize=chunksize)):
+                if value is None:
+                    # Don't match against the hash of what the file used to contain
+                    self.connection.execute("DELETE FROM dhashes WHERE path = ?", (filename,))
+                    continue
+                self.connection.execute("INSERT OR REPLACE INTO dhashes VALUES (?, ?, ?, ?, ?)",
+                                        (filename, size, mtime_ns, hash_size, value.to_bytes(hash_bytes, 'big')))
+        self.connection.commit()
+        return len(pending)
+
+    def hashes(self, hash_size=16):
+        """ Sorted list of (filename, hash) of the images hashed at hash_size """
+        return [(path, int.from_bytes(value, 'big')) for path, value in
+                self.connection.execute("SELECT path, hash FROM dhashes WHERE hash_size = ? ORDER BY path", (hash_size,))]
+
+def keep_list(hashes, radius=3, candidates=None):
+    """
+    Keep the first image, in sorted order, of every group of near-duplicates.
+    :param hashes: Sorted (filename, hash) pairs.
+    :param radius: Maximum Hamming distance between hashes of near-duplicates.
+    :param candidates: Optional set of filenames to restrict the selection to.
+    :return: (kept filenames, {duplicate filename: kept filename it matches})
+    """
+    tree = BKTree()
+    kept = []
+    duplicates = {}
+    for filename, value in hashes:
+        if candidates is not None and filename not in candidates:
+            continue
+        matches = tree.query(value, radius)
+        if matches:
+            duplicates[filename] = min(matches)[1]
+        else:
+            tree.add(value, filename)
+            kept.append(filename)
+    return kept, duplicates
+
+def main():
+    parser = argparse.ArgumentParser(description="List the images in a folder that are not near-duplicates of an earlier image.")
+    parser.add_argument('source_dir', type=str, help="Folder with images")
+    parser.add_argument('--index', type=str, default=None, help=f"Index file (default: <source_dir>/{INDEX_FILENAME})")
+    parser.add_argument('--hash_size', type=int, default=16, help="Hash thumbnail height, the hash has hash_size ** 2 bits")
+    parser.add_argument('--radius', type=int, default=None, help="Maximum Hamming distance to count as a duplicate (default: 3 per 256 hash bits)")
+    parser.add_argument('--input_list', type=str, default=None, help="Only consider the filenames in this list, e.g. not_blown_out_images.txt")
+    parser.add_argument('--output_file', type=str, default=None, help="Output list (default: <source_dir>/unique_images.txt)")
+    parser.add_argument('--workers', type=int, default=None, help="Number of worker processes (default: CPU count)")
+
+    args = parser.parse_args()
+    with HashIndex(args.source_dir, args.index) as index:
+        hashed = index.update(args.hash_size, args.workers)
+        print(f"Hashed {hashed} new or changed images")
+        hashes = index.hashes(args.hash_size)
+
+    candidates = None
+    if args.input_list:
+        with open(args.input_list) as file:
+            candidates = set(line.strip() for line in file if line.strip())
+
+    radius = args.radius if args.radius is not None else default_radius(args.hash_size)
+    kept, duplicates = keep_list(hashes, radius, candidates)
+
+    output_file = args.output_file or os.path.join(args.source_dir, 'unique_images.txt')
+    with open(output_file, 'w') as file:
+        for filename in kept:
+            file.write(filename + '\n')
+    print(f"List of {len(kept)} unique images saved to {output_file} ({len(duplicates)} near-duplicates dropped)")
+
+if __name__ == "__main__":
+    main()
+
+#python dedup.py /Volumes/Solardisk/scraper_all_images_flat/boul-60-70 --input_list /Volumes/Solardisk/scraper_all_images_flat/boul-60-70/not_blown_out_images.txt
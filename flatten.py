@@ -0,0 +1,184 @@
+import os
+import sys
+import json
+import shutil
+import argparse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from manifest import atomic_path, atomic_write_bytes
+
+FICLONE = 0x40049409  # Linux ioctl to share extents between files (btrfs, xfs)
+NAMES_FILENAME = '.flatten_names.json'
+
+def walk_files(source_dir, exclude=None):
+    """
+    Yield (relative path, DirEntry) of every regular file under source_dir, in sorted order.
+    Directories are read with os.scandir, so file types and stats come from the listing.
+    """
+    stack = ['']
+    while stack:
+        relative_dir = stack.pop()
+        directory = os.path.join(source_dir, relative_dir)
+        if exclude is not None and os.path.abspath(directory) == exclude:
+            continue
+        with os.scandir(directory) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name)
+        subdirs = []
+        for entry in entries:
+            relative_path = os.path.join(relative_dir, entry.name)
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(relative_path)
+            elif entry.is_file(follow_symlinks=False):
+                yield relative_path, entry
+        stack.extend(reversed(subdirs))
+
+def flat_names(relative_paths, assigned=None, taken=()):
+    """
+    Map each relative path to a unique flat filename.
+    Basenames that occur once are kept; all files sharing a basename get their
+    directory path as prefix (a/b/x.jpg -> a_b_x.jpg), so the result does not
+    depend on the order files are found in.
+    :param assigned: {relative path: name} from earlier runs. These paths keep their
+                     name and no other path gets it, so adding files never moves one.
+    :param taken: Other names that must not be used, e.g. unrelated files in the target.
+    """
+    assigned = assigned or {}
+    names = {path: assigned[path] for path in relative_paths if path in assigned}
+    used = set(assigned.values()) | set(taken)
+    new_paths = sorted(path for path in relative_paths if path not in assigned)
+    counts = Counter(os.path.basename(path) for path in new_paths)
+    # Basenames that are unique among the new files and not taken keep their name
+    kept = set(name for name, count in counts.items() if count == 1 and name not in used)
+    used |= kept
+    for path in new_paths:
+        name = os.path.basename(path)
+        if name not in kept:
+            name = path.replace(os.sep, '_')
+            base, ext = os.path.splitext(name)
+            suffix = 1
+            while name in used:
+                name = f"{base}_{suffix}{ext}"
+                suffix += 1
+            used.add(name)
+        names[path] = name
+    return names
+
+def reflink(source_path, target_path):
+    """ Copy-on-write clone of source_path, raises OSError where unsupported """
+    if sys.platform == 'darwin':
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.clonefile(os.fsencode(source_path), os.fsencode(target_path), 0) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), source_path)
+    else:
+        import fcntl
+        with open(source_path, 'rb') as source, open(target_path, 'wb') as target:
+            try:
+                fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+            except OSError:
+                target.close()
+                os.remove(target_path)
+                raise
+    shutil.copystat(source_path, target_path)
+
+def is_unchanged(source_stat, target_path):
+    """ True if target_path is the same file, or a copy with the same size and mtime """
+    try:
+        target_stat = os.stat(target_path)
+    except FileNotFoundError:
+        return False
+    if (target_stat.st_dev, target_stat.st_ino) == (source_stat.st_dev, source_stat.st_ino):
+        return True
+    return target_stat.st_size == source_stat.st_size and target_stat.st_mtime_ns == source_stat.st_mtime_ns
+
+def place_file(source_path, target_path, method):
+    """
+    Link or copy one file into place through a temporary name.
+    :return: The method that was used, falling back to 'copy' when linking fails.
+    """
+    with atomic_path(target_path) as temp_path:
+        if method == 'hardlink':
+            try:
+                os.link(source_path, temp_path)
+            except OSError:
+                method = 'copy'
+        elif method == 'reflink':
+            try:
+                reflink(source_path, temp_path)
+            except OSError:
+                method = 'copy'
+        if method == 'copy':
+            shutil.copy2(source_path, temp_path)
+    return method
+
+def flatten(source_dir, target_dir, method='auto', workers=16, skip_unchanged=True):
+    """
+    Collect every file under source_dir into the flat target_dir.
+    :param method: 'hardlink', 'reflink', 'copy', or 'auto' for a hardlink when both
+                   folders are on the same filesystem and a copy otherwise.
+    :return: Counter of the methods used, plus 'skipped' for unchanged files.
+
+    The names given out are kept in NAMES_FILENAME in target_dir, so a rerun after
+    files were added gives existing files the same name and new files a free one.
+    Names of files removed from source_dir stay reserved.
+    """
+    os.makedirs(target_dir, exist_ok=True)
+    if method == 'auto':
+        method = 'hardlink' if os.stat(source_dir).st_dev == os.stat(target_dir).st_dev else 'copy'
+
+    files = dict(walk_files(source_dir, exclude=os.path.abspath(target_dir)))
+    names_path = os.path.join(target_dir, NAMES_FILENAME)
+    assigned = {}
+    if os.path.exists(names_path):
+        with open(names_path) as file:
+            assigned = json.load(file)
+
+    # Other files in the target are never overwritten. One that is an unchanged copy of a
+    # source file under its plain or prefixed name (e.g. from a run before the names
+    # were recorded) is taken over as that file's name
+    taken = set(os.listdir(target_dir)) - set(assigned.values()) - {NAMES_FILENAME}
+    for path in sorted(files):
+        if path in assigned:
+            continue
+        for name in (os.path.basename(path), path.replace(os.sep, '_')):
+            if name in taken and is_unchanged(files[path].stat(follow_symlinks=False), os.path.join(target_dir, name)):
+                assigned[path] = name
+                taken.discard(name)
+                break
+
+    names = flat_names(list(files), assigned, taken)
+    atomic_write_bytes(names_path, json.dumps({**assigned, **names}, indent=1, sort_keys=True).encode())
+
+    def process(relative_path):
+        entry = files[relative_path]
+        target_path = os.path.join(target_dir, names[relative_path])
+        if skip_unchanged and is_unchanged(entry.stat(follow_symlinks=False), target_path):
+            return 'skipped'
+        try:
+            return place_file(entry.path, target_path, method)
+        except OSError as e:
+            print(f"Error processing {entry.path}: {e}")
+            return 'failed'
+
+    # Links are metadata operations and copies release the GIL, so threads suffice
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = Counter(executor.map(process, sorted(files)))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Collect all files from a folder tree into one flat folder.")
+    parser.add_argument('source_dir', type=str, help="Folder tree to copy files from")
+    parser.add_argument('target_dir', type=str, help="Flat folder to collect the files in")
+    parser.add_argument('--method', type=str, default='auto', choices=['auto', 'hardlink', 'reflink', 'copy'], help="How to place files in the target folder")
+    parser.add_argument('--workers', type=int, default=16, help="Number of threads")
+    parser.add_argument('--no_skip', dest='skip_unchanged', action='store_false', help="Replace files even if they are unchanged")
+
+    args = parser.parse_args()
+    results = flatten(args.source_dir, args.target_dir, args.method, args.workers, args.skip_unchanged)
+    print(', '.join(f"{count} {result}" for result, count in sorted(results.items())) or "No files found")
+
+if __name__ == "__main__":
+    main()
+
+#python flatten.py /Volumes/Solardisk/scraper_solar_get_more /Volumes/Solardisk/scraper_all_images_flat
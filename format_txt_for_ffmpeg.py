@@ -1,15 +1,27 @@
-# Path to your existing file containing the list of filenames
-input_file_path = '/Volumes/Solardisk/scraper_all_images_flat/boul-60-70/not_blown_out_images.txt'
+import argparse
 
-# Path to the new file that will be created, with "file" prefixed
-output_file_path = '/Volumes/Solardisk/scraper_all_images_flat/boul-60-70/not_blown_out_images-ffmpeg.txt'
+def write_ffmpeg_list(filenames, output_file_path):
+    """Write filenames as an ffmpeg concat demuxer list ("file '<name>'" per line)."""
+    with open(output_file_path, 'w') as output_file:
+        for filename in filenames:
+            output_file.write(f"file '{filename}'\n")
 
-# Open the existing file to read and the new file to write
-with open(input_file_path, 'r') as input_file, open(output_file_path, 'w') as output_file:
-    for line in input_file:
-        # Strip newline characters from the end of the line, then format with "file" directive
-        formatted_line = f"file '{line.strip()}'\n"
-        # Write the formatted line to the new file
-        output_file.write(formatted_line)
+def format_txt_for_ffmpeg(input_file_path, output_file_path):
+    # Strip newline characters from the end of each line, then format with "file" directive
+    with open(input_file_path, 'r') as input_file:
+        filenames = [line.strip() for line in input_file]
+    write_ffmpeg_list(filenames, output_file_path)
+    print(f"Formatted filenames have been saved to {output_file_path}")
 
-print(f"Formatted filenames have been saved to {output_file_path}")
+def main():
+    parser = argparse.ArgumentParser(description="Prefix each filename in a list with the ffmpeg concat 'file' directive.")
+    parser.add_argument('input_file_path', type=str, help="Existing file containing the list of filenames")
+    parser.add_argument('output_file_path', type=str, help="New file that will be created, with 'file' prefixed")
+
+    args = parser.parse_args()
+    format_txt_for_ffmpeg(args.input_file_path, args.output_file_path)
+
+if __name__ == "__main__":
+    main()
+
+#python format_txt_for_ffmpeg.py /Volumes/Solardisk/scraper_all_images_flat/boul-60-70/not_blown_out_images.txt /Volumes/Solardisk/scraper_all_images_flat/boul-60-70/not_blown_out_images-ffmpeg.txt
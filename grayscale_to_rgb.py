@@ -1,27 +1,42 @@
 from PIL import Image
 import os
+import argparse
+from manifest import Manifest, atomic_save
 
-def convert_grayscale_to_rgb(input_folder, output_folder):
+def convert_grayscale_to_rgb(input_folder, output_folder, resume=True, use_hash=False):
     # Create the output folder if it doesn't exist
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
-    # Process each file in the input folder
-    for filename in os.listdir(input_folder):
-        if filename.endswith(".jpg"):
-            file_path = os.path.join(input_folder, filename)
-            
-            # Open the image
-            with Image.open(file_path) as img:
-                # Convert the image to RGB
-                rgb_img = img.convert("RGB")
-                
-                # Save the converted image to the output folder with high quality
-                output_path = os.path.join(output_folder, filename)
-                rgb_img.save(output_path, quality=95, optimize=True, progressive=True)
-
-# Set your input and output folder paths
-input_folder = './solar-big-bear-black'
-output_folder = './solar-big-bear-color'
-
-convert_grayscale_to_rgb(input_folder, output_folder)
+    # Process each file in the input folder, skipping files converted on a previous run
+    with Manifest(output_folder, {'quality': 95, 'optimize': True, 'progressive': True}, use_hash) as manifest:
+        for filename in os.listdir(input_folder):
+            if filename.endswith(".jpg"):
+                file_path = os.path.join(input_folder, filename)
+                if resume and manifest.is_up_to_date(file_path):
+                    continue
+
+                # Open the image
+                with Image.open(file_path) as img:
+                    # Convert the image to RGB
+                    rgb_img = img.convert("RGB")
+
+                    # Save the converted image to the output folder with high quality
+                    output_path = os.path.join(output_folder, filename)
+                    atomic_save(rgb_img, output_path, quality=95, optimize=True, progressive=True)
+                manifest.record(file_path, [filename])
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the grayscale JPGs in a folder to RGB.")
+    parser.add_argument('input_folder', type=str, help="Folder with the grayscale JPGs")
+    parser.add_argument('output_folder', type=str, help="Folder for the RGB JPGs")
+    parser.add_argument('--no_resume', dest='resume', action='store_false', help="Convert all images even if their output is up to date")
+    parser.add_argument('--use_hash', action='store_true', help="Compare file contents, not only size and mtime, when resuming")
+
+    args = parser.parse_args()
+    convert_grayscale_to_rgb(args.input_folder, args.output_folder, args.resume, args.use_hash)
+
+if __name__ == "__main__":
+    main()
+
+#python grayscale_to_rgb.py ./solar-big-bear-black ./solar-big-bear-color
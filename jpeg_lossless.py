@@ -0,0 +1,178 @@
+import shutil
+import warnings
+import subprocess
+from contextlib import nullcontext
+import numpy as np
+from PIL import Image
+from manifest import atomic_path
+
+# Optional: jpeglib (pip install jpeglib) gives access to the DCT coefficients of a JPEG.
+# Without it the functions below return False and callers use their pixel path.
+try:
+    import jpeglib
+except ImportError:
+    jpeglib = None
+
+# Optional: libjpeg-turbo's jpegtran crops in the DCT domain without going through Python
+JPEGTRAN = shutil.which('jpegtran')
+
+def lossless_available(corners=False):
+    """
+    True if a lossless backend is installed: jpegtran or jpeglib for crops, jpeglib for corners.
+    Otherwise warns (once) that the pixel path will re-encode.
+    """
+    if (JPEGTRAN is not None and not corners) or jpeglib is not None:
+        return True
+    if corners:
+        warnings.warn("Lossless corners need jpeglib (pip install jpeglib), which is not installed: "
+                      "falling back to decoding and re-encoding")
+    else:
+        warnings.warn("Lossless crops need jpegtran or jpeglib (pip install jpeglib), neither is installed: "
+                      "falling back to decoding and re-encoding")
+    return False
+
+def _turbo():
+    """ jpeglib bundles several libjpeg builds; its libjpeg-turbo reads and writes about twice as fast as the default 6b """
+    turbo = sorted(version for version in jpeglib.version.versions() if version.startswith('turbo'))
+    return jpeglib.version(turbo[-1]) if turbo else nullcontext()
+
+def _read_dct(image_path, output_path):
+    """ DCT coefficients of a grayscale or YCbCr JPEG written to a JPEG output, otherwise None """
+    if jpeglib is None or not output_path.lower().endswith(('.jpg', '.jpeg')):
+        return None
+    try:
+        with _turbo():
+            dct = jpeglib.read_dct(image_path)
+            dct.load()
+    except Exception:
+        return None
+    if str(dct.jpeg_color_space) not in ('JCS_GRAYSCALE', 'JCS_YCbCr') or dct.has_black:
+        return None
+    return dct
+
+def _components(dct):
+    """ (name, vertical, horizontal sampling factor) of each component """
+    names = ['Y', 'Cb', 'Cr'] if dct.has_chrominance else ['Y']
+    return [(name, int(v), int(h)) for name, (v, h) in zip(names, dct.samp_factor)]
+
+def mcu_size(dct):
+    """ (height, width) in pixels of one minimum coded unit """
+    v_max, h_max = np.asarray(dct.samp_factor).max(axis=0)
+    return 8 * int(v_max), 8 * int(h_max)
+
+def _blocks(pixels, sampling, sampling_max):
+    """ Number of 8x8 blocks of a component spanning the first pixels rows/columns of the image """
+    samples = -(-pixels * sampling // sampling_max)
+    return -(-samples // 8)
+
+def _block_range(start, stop, sampling, sampling_max):
+    """ Blocks of a component covering pixel rows/columns start:stop, start being MCU aligned """
+    return start * sampling // (8 * sampling_max), _blocks(stop, sampling, sampling_max)
+
+def _write(dct, output_path):
+    with atomic_path(output_path) as temp_path, _turbo():
+        dct.write_dct(temp_path)
+
+def _crop_box(width, height, new_width, new_height, mcu_height, mcu_width):
+    """ Left and top of the centered crop, snapped down to the MCU grid """
+    left = round((width - new_width) / 2) // mcu_width * mcu_width
+    top = round((height - new_height) / 2) // mcu_height * mcu_height
+    return left, top
+
+def _jpegtran_crop(image_path, output_path, new_width, new_height):
+    """ Crop with jpegtran -crop, see lossless_crop_center. False if it can't be used. """
+    if JPEGTRAN is None or not output_path.lower().endswith(('.jpg', '.jpeg')):
+        return False
+    try:
+        with Image.open(image_path) as img:
+            if img.format != 'JPEG':
+                return False
+            width, height = img.size
+            # (component id, horizontal, vertical sampling factor, quantization table)
+            mcu_width = 8 * max(layer[1] for layer in img.layer)
+            mcu_height = 8 * max(layer[2] for layer in img.layer)
+    except Exception:
+        return False
+    if new_width > width or new_height > height:
+        return False
+
+    # With an MCU aligned corner jpegtran keeps the requested size exactly
+    left, top = _crop_box(width, height, new_width, new_height, mcu_height, mcu_width)
+    try:
+        with atomic_path(output_path) as temp_path:
+            subprocess.run([JPEGTRAN, '-copy', 'all', '-crop', f"{new_width}x{new_height}+{left}+{top}",
+                            '-outfile', temp_path, image_path], check=True, capture_output=True)
+    except (OSError, subprocess.CalledProcessError):
+        return False
+    return True
+
+def lossless_crop_center(image_path, output_path, new_width=1835, new_height=1835):
+    """
+    Crop the center of a JPEG by slicing its DCT blocks, without decoding or re-encoding.
+    The left and top edges snap down to the MCU grid (8 or 16 pixels), so the crop can
+    sit up to one MCU left/up of the exact center. The output size is exact.
+    Uses jpegtran when it is installed, otherwise jpeglib, which is slower than the
+    pixel path: what it buys is no generation loss.
+    :return: True if the crop was written, False if the pixel path must be used.
+    """
+    if not lossless_available():
+        return False
+    if _jpegtran_crop(image_path, output_path, new_width, new_height):
+        return True
+
+    dct = _read_dct(image_path, output_path)
+    if dct is None or new_width > dct.width or new_height > dct.height:
+        return False
+
+    mcu_height, mcu_width = mcu_size(dct)
+    left, top = _crop_box(dct.width, dct.height, new_width, new_height, mcu_height, mcu_width)
+    v_max, h_max = np.asarray(dct.samp_factor).max(axis=0)
+
+    for name, v, h in _components(dct):
+        first_row = top * v // (8 * v_max)
+        first_col = left * h // (8 * h_max)
+        rows = _blocks(new_height, v, v_max)
+        cols = _blocks(new_width, h, h_max)
+        setattr(dct, name, np.ascontiguousarray(getattr(dct, name)[first_row:first_row + rows, first_col:first_col + cols]))
+    dct.height = new_height
+    dct.width = new_width
+    _write(dct, output_path)
+    return True
+
+def lossless_black_corners(image_path, output_path, square_size):
+    """
+    Black out the four corners of a JPEG in the DCT domain: blocks in the corners get
+    the DC coefficient of black and no AC coefficients, all other blocks are copied unchanged.
+    The squares grow to the MCU grid, so they always cover what add_black_corners paints.
+    Needs jpeglib; the point is no generation loss, not speed.
+    :return: True if the image was written, False if the pixel path must be used.
+    """
+    if not lossless_available(corners=True):
+        return False
+    dct = _read_dct(image_path, output_path)
+    if dct is None or square_size >= min(dct.width, dct.height):
+        return False
+
+    mcu_height, mcu_width = mcu_size(dct)
+    v_max, h_max = np.asarray(dct.samp_factor).max(axis=0)
+    # ImageDraw rectangles include their end point, so the top/left squares are square_size + 1 wide
+    near_rows = (0, -(-(square_size + 1) // mcu_height) * mcu_height)
+    near_cols = (0, -(-(square_size + 1) // mcu_width) * mcu_width)
+    far_rows = ((dct.height - square_size) // mcu_height * mcu_height, dct.height)
+    far_cols = ((dct.width - square_size) // mcu_width * mcu_width, dct.width)
+
+    for i, (name, v, h) in enumerate(_components(dct)):
+        blocks = getattr(dct, name)
+        # Level shifted black (0 - 128) for luma, neutral chroma
+        quantization = dct.qt[dct.quant_tbl_no[i]][0, 0]
+        dc = int(round(-1024 / quantization)) if name == 'Y' else 0
+        for rows in (near_rows, far_rows):
+            for cols in (near_cols, far_cols):
+                first_row, last_row = _block_range(rows[0], rows[1], v, v_max)
+                first_col, last_col = _block_range(cols[0], cols[1], h, h_max)
+                region = blocks[first_row:last_row, first_col:last_col]
+                region[...] = 0
+                region[:, :, 0, 0] = dc
+        setattr(dct, name, blocks)
+    _write(dct, output_path)
+    return True
@@ -0,0 +1,116 @@
+import os
+import json
+import hashlib
+from contextlib import contextmanager
+from PIL import Image
+
+MANIFEST_FILENAME = '.manifest.json'
+
+def _temp_path(path):
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.{os.getpid()}.tmp")
+
+@contextmanager
+def atomic_path(path):
+    """ Yield a temporary path in path's folder, moved over path if the block succeeds and removed if not """
+    temp_path = _temp_path(path)
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def atomic_write_bytes(path, data):
+    """ Write data to path through a temporary file, so readers never see a truncated file """
+    with atomic_path(path) as temp_path:
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+
+def atomic_save(image, path, **params):
+    """ image.save(path, **params) through a temporary file in the same folder """
+    image_format = params.pop('format', None) or Image.registered_extensions()[os.path.splitext(path)[1].lower()]
+    with atomic_path(path) as temp_path:
+        image.save(temp_path, image_format, **params)
+
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class Manifest:
+    """
+    Record of which inputs have been processed into an output folder, and with which parameters.
+
+    Each entry stores the input's size, mtime (and sha1 with use_hash) and the
+    output filenames it produced. An input is up to date when its fingerprint
+    matches and all its outputs still exist. A change of params invalidates all
+    entries. With use_hash, inputs whose mtime changed but whose content did
+    not (e.g. after copying to another volume) are still up to date.
+    """
+
+    def __init__(self, output_folder, params, use_hash=False, save_every=50):
+        self.output_folder = output_folder
+        self.path = os.path.join(output_folder, MANIFEST_FILENAME)
+        self.params = json.loads(json.dumps(params))
+        self.use_hash = use_hash
+        self.save_every = save_every
+        self.entries = {}
+        self._unsaved = 0
+
+        if os.path.exists(self.path):
+            with open(self.path) as file:
+                stored = json.load(file)
+            if stored.get('params') == self.params:
+                self.entries = stored.get('entries', {})
+
+    def _fingerprint(self, input_path, entry=None):
+        stat = os.stat(input_path)
+        fingerprint = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        if self.use_hash:
+            if entry is not None and entry.get('hash') and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+                fingerprint['hash'] = entry['hash']
+            else:
+                fingerprint['hash'] = file_hash(input_path)
+        return fingerprint
+
+    def is_up_to_date(self, input_path):
+        entry = self.entries.get(os.path.basename(input_path))
+        if entry is None:
+            return False
+        if not all(os.path.exists(os.path.join(self.output_folder, output)) for output in entry['outputs']):
+            return False
+        fingerprint = self._fingerprint(input_path, entry)
+        if self.use_hash:
+            if fingerprint['hash'] != entry.get('hash'):
+                return False
+            # Same content, remember the new stat so the next check can skip hashing
+            if fingerprint['size'] != entry['size'] or fingerprint['mtime_ns'] != entry['mtime_ns']:
+                entry.update(fingerprint)
+                self._unsaved += 1
+            return True
+        return fingerprint['size'] == entry['size'] and fingerprint['mtime_ns'] == entry['mtime_ns']
+
+    def outputs(self, input_path):
+        return self.entries[os.path.basename(input_path)]['outputs']
+
+    def record(self, input_path, outputs):
+        """ Mark input_path as processed into outputs (filenames in the output folder) """
+        entry = self._fingerprint(input_path)
+        entry['outputs'] = list(outputs)
+        self.entries[os.path.basename(input_path)] = entry
+        self._unsaved += 1
+        if self._unsaved >= self.save_every:
+            self.save()
+
+    def save(self):
+        atomic_write_bytes(self.path, json.dumps({'params': self.params, 'entries': self.entries}).encode())
+        self._unsaved = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.save()
@@ -1,53 +1,160 @@
+import io
 import os
+import re
 import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from PIL import Image
+from shards import open_writer
 
 def is_image_file(filename):
     """Check if a file is an image based on its extension."""
     valid_extensions = ['.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff']
     return any(filename.lower().endswith(ext) for ext in valid_extensions)
 
-def pair_images(folder_a, folder_b, output_folder):
-    # Ensure the output folder exists
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
+def stem_key(filename):
+    """Match files by name without extension."""
+    return os.path.splitext(filename)[0]
 
-    # Get the list of image filenames in both folders, filtering non-image files
+def tile_key(filename):
+    """Match tiles by '<stem>_tile<idx>', ignoring any suffix added after the tile index."""
+    match = re.match(r'(.*_tile\d+)', stem_key(filename))
+    return match.group(1) if match else stem_key(filename)
+
+KEY_FUNCTIONS = {'stem': stem_key, 'tile': tile_key}
+
+def match_pairs(folder_a, folder_b, key='stem'):
+    """
+    Match the images of two folders by key.
+    :param key: 'stem', 'tile', a function of the filename, or 'position' to pair the sorted listings in order.
+    :return: (pairs, orphans_a, orphans_b), pairs being sorted (key, name_a, name_b) tuples.
+    """
     images_a = sorted(filter(is_image_file, os.listdir(folder_a)))
     images_b = sorted(filter(is_image_file, os.listdir(folder_b)))
 
-    # Check if both folders have the same number of images
-    if len(images_a) != len(images_b):
-        print("The folders contain a different number of images. Please check your folders.")
-        return
+    if key == 'position':
+        pairs = [(img_a_name, img_a_name, img_b_name) for img_a_name, img_b_name in zip(images_a, images_b)]
+        return pairs, images_a[len(pairs):], images_b[len(pairs):]
+
+    key_function = KEY_FUNCTIONS.get(key, key)
+    index_b = {}
+    orphans_b = []
+    for img_b_name in images_b:
+        # A second file with the same key (e.g. x.jpg and x.png) cannot be matched unambiguously
+        if index_b.setdefault(key_function(img_b_name), img_b_name) != img_b_name:
+            orphans_b.append(img_b_name)
+
+    pairs = []
+    orphans_a = []
+    for img_a_name in images_a:
+        img_key = key_function(img_a_name)
+        img_b_name = index_b.pop(img_key, None)
+        if img_b_name is None:
+            orphans_a.append(img_a_name)
+        else:
+            pairs.append((img_key, img_a_name, img_b_name))
+    orphans_b.extend(index_b.values())
+    return pairs, orphans_a, sorted(orphans_b)
+
+class PairDataset:
+    """
+    Lazily decoded (key, image A, image B) pairs from two folders, matched by key.
+
+    Images are decoded on access and kept in an LRU cache of cache_size images.
+    iterate() decodes ahead on a thread pool; Pillow releases the GIL while decoding.
+    Cached images are shared, copy them before modifying.
+    """
+
+    def __init__(self, folder_a, folder_b, key='stem', cache_size=64):
+        self.folder_a = folder_a
+        self.folder_b = folder_b
+        self.pairs, self.orphans_a, self.orphans_b = match_pairs(folder_a, folder_b, key)
+        self._load = lru_cache(maxsize=cache_size)(self._decode)
+
+    @staticmethod
+    def _decode(path):
+        image = Image.open(path)
+        image.load()
+        return image
 
-    # Pair images side by side
-    for img_a_name, img_b_name in zip(images_a, images_b):
-        path_a = os.path.join(folder_a, img_a_name)
-        path_b = os.path.join(folder_b, img_b_name)
+    def __len__(self):
+        return len(self.pairs)
 
+    def __getitem__(self, i):
+        img_key, img_a_name, img_b_name = self.pairs[i]
+        return (img_key,
+                self._load(os.path.join(self.folder_a, img_a_name)),
+                self._load(os.path.join(self.folder_b, img_b_name)))
+
+    def __iter__(self):
+        return self.iterate()
+
+    def iterate(self, fn=None, prefetch=8, workers=4):
+        """
+        Yield fn(i) (default: self[i]) for every pair in order, computing up to
+        prefetch items ahead on a pool of worker threads.
+        """
+        fn = fn or self.__getitem__
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            remaining = iter(range(len(self)))
+            try:
+                while True:
+                    while len(pending) < prefetch:
+                        i = next(remaining, None)
+                        if i is None:
+                            break
+                        pending.append(executor.submit(fn, i))
+                    if not pending:
+                        return
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+def pair_images(folder_a, folder_b, output_folder, shard_size=None, key='stem', workers=4):
+    dataset = PairDataset(folder_a, folder_b, key, cache_size=2 * workers)
+
+    # Report files that have no counterpart instead of refusing to run
+    for folder, orphans in ((folder_a, dataset.orphans_a), (folder_b, dataset.orphans_b)):
+        if orphans:
+            print(f"{len(orphans)} images in {folder} have no match: {', '.join(orphans[:10])}{' ...' if len(orphans) > 10 else ''}")
+
+    def encode_pair(i):
+        img_key, img_a_name, img_b_name = dataset.pairs[i]
         try:
-            with Image.open(path_a) as img_a, Image.open(path_b) as img_b:
-                # Create a new image with double the width of the originals (assuming they are the same size)
-                dst = Image.new('RGB', (img_a.width + img_b.width, img_a.height))
-                dst.paste(img_a, (0, 0))
-                dst.paste(img_b, (img_a.width, 0))
-
-                # Save the paired image to the output folder
-                output_path = os.path.join(output_folder, f"paired_{img_a_name}")
-                dst.save(output_path, "JPEG", quality=95)  # Adjust quality as needed, max is 95 for JPEG
+            _, img_a, img_b = dataset[i]
+            # Create a new image with double the width of the originals (assuming they are the same size)
+            dst = Image.new('RGB', (img_a.width + img_b.width, img_a.height))
+            dst.paste(img_a, (0, 0))
+            dst.paste(img_b, (img_a.width, 0))
+
+            buffer = io.BytesIO()
+            dst.save(buffer, "JPEG", quality=95)  # Adjust quality as needed, max is 95 for JPEG
+            return f"paired_{img_a_name}", buffer.getvalue()
         except Exception as e:
             print(f"Error processing {img_a_name} and {img_b_name}: {e}")
+            return None
+
+    # Save the paired images side by side, into the output folder or into shards
+    with open_writer(output_folder, shard_size) as writer:
+        for result in dataset.iterate(encode_pair, prefetch=2 * workers, workers=workers):
+            if result is not None:
+                writer.write(*result)
 
 def main():
     parser = argparse.ArgumentParser(description="Pair images from two folders side by side into a third folder.")
     parser.add_argument('folder_a', type=str, help="Path to folder A")
     parser.add_argument('folder_b', type=str, help="Path to folder B")
     parser.add_argument('output_folder', type=str, help="Path to the output folder")
+    parser.add_argument('--shard_size', type=int, default=None, help="Write tar shards of this many pairs with an index instead of one file each")
+    parser.add_argument('--key', type=str, default='stem', choices=['stem', 'tile', 'position'], help="How to match images between the folders")
+    parser.add_argument('--workers', type=int, default=4, help="Number of decode/encode threads")
 
     args = parser.parse_args()
 
-    pair_images(args.folder_a, args.folder_b, args.output_folder)
+    pair_images(args.folder_a, args.folder_b, args.output_folder, args.shard_size, args.key, args.workers)
 
 if __name__ == "__main__":
     main()
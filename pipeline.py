@@ -0,0 +1,104 @@
+import os
+import json
+import argparse
+from functools import partial
+from PIL import Image
+from crop import crop_center_image
+from blockblack import add_black_corners
+from turbulence_emulation import build_parser, check_args, render_outputs, iter_rendered
+from shards import open_writer
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+# Example config, replacing crop.py -> blockblack.py -> grayscale_to_rgb.py -> turbulence_emulation.py:
+# {
+#     "source_folder": "/Volumes/Solardisk/sunplanet/040124-lowdisc/timelapse5sec200/pss",
+#     "crop": {"new_width": 1835, "new_height": 1835},
+#     "black_corners": {"square_size": 260},
+#     "workers": 4,
+#     "variants": [
+#         {"dest_folder": "/Users/espensommereide/Developer/solar-dataset/solar-tiles-org", "tile": true, "colorize": true, "max_tiles": 5000},
+#         {"dest_folder": "/Users/espensommereide/Developer/solar-dataset/solar-tiles-turb", "tile": true, "colorize": true, "max_tiles": 5000,
+#          "enable_blur": true, "enable_turbulence": true, "enable_contrast": true, "kernel_size": 5, "amplitude": 2, "frequency": 10, "contrast_factor": 0.5}
+#     ]
+# }
+# Each variant accepts the turbulence_emulation.py options. "colorize" replaces grayscale_to_rgb.py,
+# since turbulence_emulation.py converted its input back to grayscale anyway.
+
+# turbulence_emulation.py options that a variant can't set: the source folder and worker
+# count belong to the whole pipeline, and the pipeline does not resume from a manifest
+PIPELINE_OPTIONS = ('source_folder', 'workers', 'resume', 'use_hash')
+
+def variant_args(config, variant):
+    """ turbulence_emulation.py arguments for one variant, starting from its command line defaults """
+    args = build_parser().parse_args([config['source_folder'], variant['dest_folder']])
+    for key, value in variant.items():
+        if key in PIPELINE_OPTIONS:
+            raise ValueError(f"Variant option {key} is not supported, set it at the top level of the config or leave it out")
+        if not hasattr(args, key):
+            raise ValueError(f"Unknown variant option: {key}")
+        setattr(args, key, float('inf') if key == 'max_tiles' and value is None else value)
+    check_args(args)
+    return args
+
+def preprocess(img, config):
+    """ Shared in-memory stages, applied once per decoded frame """
+    if 'crop' in config:
+        img = crop_center_image(img, **config['crop'])
+    if 'black_corners' in config:
+        img = add_black_corners(img, config['black_corners']['square_size'])
+    return img.convert('L')
+
+def render_frame(config, variants, filename, limits):
+    """ Decode one source frame and render the outputs of every variant from it, no outputs if that fails """
+    image_path = os.path.join(config['source_folder'], filename)
+    try:
+        with Image.open(image_path) as img:
+            image = preprocess(img, config)
+    except Exception as e:
+        print(f"Error processing {image_path}: {e}")
+        return [[] for _ in variants]
+    return [render_outputs(image, filename, args, limit) if limit > 0 else []
+            for args, limit in zip(variants, limits)]
+
+def run_pipeline(config):
+    variants = [variant_args(config, variant) for variant in config['variants']]
+    writers = [open_writer(args.dest_folder, args.shard_size) for args in variants]
+
+    filenames = [filename for filename in sorted(os.listdir(config['source_folder']))
+                 if filename.lower().endswith(IMAGE_EXTENSIONS)]
+
+    counts = [0] * len(variants)
+    limits = lambda: [args.max_tiles - count for args, count in zip(variants, counts)]
+    render = partial(render_frame, config, variants)
+    try:
+        for results in iter_rendered(filenames, render, limits, config.get('workers', 1)):
+            for i, outputs in enumerate(results):
+                for save_name, data in outputs:
+                    # Limits passed to in-flight frames are upper bounds, the exact cut happens here
+                    if counts[i] >= variants[i].max_tiles:
+                        break
+                    writers[i].write(save_name, data)
+                    counts[i] += 1
+
+            if all(count >= args.max_tiles for args, count in zip(variants, counts)):
+                print("All variants reached their limit, stopping.")
+                break
+    finally:
+        for writer in writers:
+            writer.close()
+
+    for args, count in zip(variants, counts):
+        print(f"Generated {count} files in {args.dest_folder}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run crop, corner masking, effects and tiling on each image with a single decode and encode.")
+    parser.add_argument('config', type=str, help="Path to the JSON pipeline config")
+
+    args = parser.parse_args()
+    with open(args.config) as file:
+        config = json.load(file)
+    run_pipeline(config)
+
+if __name__ == "__main__":
+    main()
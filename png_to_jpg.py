@@ -1,7 +1,63 @@
 from PIL import Image
 import os
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from manifest import Manifest, atomic_save
 
-def convert_png_to_jpg(source_folder, target_folder, quality=95):
+HIGH_BIT_DEPTH_MODES = ('I', 'I;16', 'I;16B', 'I;16L')
+
+def sequence_window(paths, low_percentile=0.5, high_percentile=99.9, sample_frames=16, pixel_stride=4):
+    """
+    Compute one (low, high) stretch window for a whole sequence of 16-bit frames,
+    so the frames of a timelapse are stretched identically and do not flicker.
+    Percentiles are taken over every pixel_stride'th pixel of up to sample_frames evenly spaced frames.
+    """
+    if not paths:
+        return 0, 65535
+    picks = np.unique(np.linspace(0, len(paths) - 1, min(sample_frames, len(paths))).astype(int))
+    samples = []
+    for i in picks:
+        with Image.open(paths[i]) as img:
+            if img.mode in HIGH_BIT_DEPTH_MODES:
+                samples.append(np.asarray(img)[::pixel_stride, ::pixel_stride].ravel())
+    if not samples:
+        return 0, 65535
+    low, high = np.percentile(np.concatenate(samples), [low_percentile, high_percentile])
+    return float(low), float(max(high, low + 1))
+
+def to_8bit(img, window=None):
+    """
+    Convert a 16-bit grayscale image to 8-bit 'L'.
+    :param window: (low, high) values mapped to 0 and 255, or None for the plain 8 bit shift.
+    """
+    pixels = np.asarray(img)
+    if window is None:
+        return Image.fromarray((pixels >> 8).clip(0, 255).astype(np.uint8))
+    low, high = window
+    scaled = (pixels.astype(np.float32) - low) * (255.0 / (high - low))
+    return Image.fromarray(np.rint(scaled).clip(0, 255).astype(np.uint8))
+
+def convert_file(source_path, target_path, quality=95, window=None):
+    """ Convert one PNG to JPG, see convert_png_to_jpg """
+    with Image.open(source_path) as img:
+        # If the image has an alpha channel, remove it by pasting onto a white background
+        if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[3] if img.mode == 'RGBA' else img.getchannel('A'))
+            img = background
+        elif img.mode == 'P':
+            # Convert paletted images to RGB
+            img = img.convert('RGB')
+
+        # Convert 16-bit images to 8-bit
+        if img.mode in HIGH_BIT_DEPTH_MODES:
+            img = to_8bit(img, window)
+
+        # Save the image as JPG with the specified quality
+        atomic_save(img, target_path, format='JPEG', quality=quality)
+
+def convert_png_to_jpg(source_folder, target_folder, quality=95, resume=True, use_hash=False, stretch='shift', window=None, percentiles=(0.5, 99.9), workers=8):
     """
     Convert all PNG images in the source folder to high-quality JPG images in the target folder.
     Handles grayscale images and images with 16-bit depth correctly.
@@ -10,39 +66,67 @@ def convert_png_to_jpg(source_folder, target_folder, quality=95):
     - source_folder: The folder containing the source PNG images.
     - target_folder: The folder where the converted JPG images will be saved.
     - quality: The quality of the JPG images, ranging from 1 (worst) to 95 (best). Default is 95.
+    - resume: Skip PNGs whose JPG is up to date according to the manifest in the target folder.
+    - use_hash: Also compare file contents, so PNGs that were only touched or copied are skipped.
+    - stretch: How 16-bit frames become 8-bit. 'shift' keeps the top 8 bits, 'fixed' maps
+      window=(low, high) to 0-255, 'percentile' computes that window once from the percentiles
+      of the whole sequence.
+    - workers: Number of threads; Pillow releases the GIL while decoding and encoding.
     """
     # Ensure target folder exists
     if not os.path.exists(target_folder):
         os.makedirs(target_folder)
 
-    # Process each file in the source folder
-    for filename in os.listdir(source_folder):
-        if filename.endswith('.png'):
-            # Open the image
-            with Image.open(os.path.join(source_folder, filename)) as img:
-                # If the image has an alpha channel, remove it by pasting onto a white background
-                if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
-                    background = Image.new('RGB', img.size, (255, 255, 255))
-                    background.paste(img, mask=img.split()[3] if img.mode == 'RGBA' else img.getchannel('A'))
-                    img = background
-                elif img.mode == 'P':
-                    # Convert paletted images to RGB
-                    img = img.convert('RGB')
-
-                # Convert 16-bit images to 8-bit
-                if img.mode in ('I', 'I;16'):
-                    img = img.point(lambda i: i*(1/256)).convert('L')
-
-                # Define the target filename and path
-                target_file = os.path.splitext(filename)[0] + '.jpg'
-                target_path = os.path.join(target_folder, target_file)
-
-                # Save the image as JPG with the specified quality
-                img.save(target_path, 'JPEG', quality=quality)
+    filenames = sorted(filename for filename in os.listdir(source_folder) if filename.endswith('.png'))
+    source_paths = [os.path.join(source_folder, filename) for filename in filenames]
+
+    if stretch == 'shift':
+        window = None
+    elif stretch == 'percentile':
+        window = sequence_window(source_paths, *percentiles)
+        print(f'Stretching 16-bit frames from {window[0]:.0f} to {window[1]:.0f}')
+    elif stretch != 'fixed' or window is None:
+        raise ValueError(f"Unknown stretch {stretch!r}, or 'fixed' without a window")
+
+    # Process each file in the source folder, skipping files converted on a previous run
+    params = {'quality': quality, 'window': list(window) if window is not None else None}
+    with Manifest(target_folder, params, use_hash) as manifest:
+        pending = [source_path for source_path in source_paths if not (resume and manifest.is_up_to_date(source_path))]
+
+        def convert(source_path):
+            # Define the target filename and path
+            target_file = os.path.splitext(os.path.basename(source_path))[0] + '.jpg'
+            try:
+                convert_file(source_path, os.path.join(target_folder, target_file), quality, window)
+                return target_file
+            except Exception as e:
+                print(f"Error processing {source_path}: {e}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for source_path, target_file in zip(pending, executor.map(convert, pending)):
+                if target_file is not None:
+                    manifest.record(source_path, [target_file])
 
     print(f'All PNG images from {source_folder} have been converted to high-quality JPG images in {target_folder}.')
 
-# Example usage
-source_folder = '/Volumes/Solardisk/sunplanet/230124-15sek23januar/ser-timelapses-15sek-400/SF-toAI'
-target_folder = '/Volumes/Solardisk/sunplanet/230124-15sek23januar/ser-timelapses-15sek-400/SF-toAIjpg'
-convert_png_to_jpg(source_folder, target_folder)
+def main():
+    parser = argparse.ArgumentParser(description="Convert the PNG images in a folder to JPG.")
+    parser.add_argument('source_folder', type=str, help="Folder containing the source PNG images")
+    parser.add_argument('target_folder', type=str, help="Folder where the converted JPG images will be saved")
+    parser.add_argument('--quality', type=int, default=95, help="JPG quality, 1 (worst) to 95 (best)")
+    parser.add_argument('--stretch', type=str, default='shift', choices=['shift', 'fixed', 'percentile'], help="How 16-bit frames are mapped to 8-bit")
+    parser.add_argument('--window', type=float, nargs=2, default=None, metavar=('LOW', 'HIGH'), help="16-bit values mapped to 0 and 255 with --stretch fixed")
+    parser.add_argument('--percentiles', type=float, nargs=2, default=(0.5, 99.9), metavar=('LOW', 'HIGH'), help="Sequence percentiles mapped to 0 and 255 with --stretch percentile")
+    parser.add_argument('--workers', type=int, default=8, help="Number of threads")
+    parser.add_argument('--no_resume', dest='resume', action='store_false', help="Convert all PNGs even if their JPG is up to date")
+    parser.add_argument('--use_hash', action='store_true', help="Compare file contents, not only size and mtime, when resuming")
+
+    args = parser.parse_args()
+    convert_png_to_jpg(args.source_folder, args.target_folder, args.quality, args.resume, args.use_hash,
+                       args.stretch, args.window, args.percentiles, args.workers)
+
+if __name__ == "__main__":
+    main()
+
+#python png_to_jpg.py /Volumes/Solardisk/sunplanet/230124-15sek23januar/ser-timelapses-15sek-400/SF-toAI /Volumes/Solardisk/sunplanet/230124-15sek23januar/ser-timelapses-15sek-400/SF-toAIjpg --stretch percentile
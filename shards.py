@@ -0,0 +1,133 @@
+import io
+import os
+import json
+import tarfile
+from PIL import Image
+from manifest import atomic_write_bytes
+
+INDEX_FILENAME = 'index.json'
+
+class DirectoryWriter:
+    """ Default output: one file per sample in dest_folder """
+
+    def __init__(self, dest_folder):
+        self.dest_folder = dest_folder
+        if not os.path.exists(dest_folder):
+            os.makedirs(dest_folder)
+
+    def write(self, name, data):
+        atomic_write_bytes(os.path.join(self.dest_folder, name), data)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class ShardWriter:
+    """
+    Write samples into uncompressed tar shards of shard_size samples each.
+
+    dest_folder gets shard-000000.tar, shard-000001.tar, ... and an index.json
+    listing every sample's name, shard and byte range, so ShardReader can
+    fetch any sample with a single read. The shards stay valid tar files
+    for rsync, tar -x and streaming loaders.
+    """
+
+    def __init__(self, dest_folder, shard_size=1000, prefix='shard'):
+        self.dest_folder = dest_folder
+        self.shard_size = shard_size
+        self.prefix = prefix
+        self.shards = []
+        self.samples = []
+        self.tar = None
+        if not os.path.exists(dest_folder):
+            os.makedirs(dest_folder)
+
+    def _next_shard(self):
+        if self.tar is not None:
+            self.tar.close()
+            self._write_index()
+        shard_name = f"{self.prefix}-{len(self.shards):06d}.tar"
+        self.shards.append(shard_name)
+        self.tar = tarfile.open(os.path.join(self.dest_folder, shard_name), 'w', format=tarfile.GNU_FORMAT)
+
+    def write(self, name, data):
+        if self.tar is None or len(self.samples) % self.shard_size == 0:
+            self._next_shard()
+        tarinfo = tarfile.TarInfo(name)
+        tarinfo.size = len(data)
+        self.tar.addfile(tarinfo, io.BytesIO(data))
+        # The member data ends at the current offset, padded to the 512 byte tar block size
+        offset = self.tar.offset - (len(data) + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE * tarfile.BLOCKSIZE
+        self.samples.append({'name': name, 'shard': len(self.shards) - 1, 'offset': offset, 'size': len(data)})
+
+    def _write_index(self):
+        index = {'shard_size': self.shard_size, 'shards': self.shards, 'samples': self.samples}
+        atomic_write_bytes(os.path.join(self.dest_folder, INDEX_FILENAME), json.dumps(index).encode())
+
+    def close(self):
+        if self.tar is not None:
+            self.tar.close()
+            self.tar = None
+        self._write_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def open_writer(dest_folder, shard_size=None):
+    """ ShardWriter when shard_size is set, otherwise the per-file DirectoryWriter """
+    if shard_size:
+        return ShardWriter(dest_folder, shard_size)
+    return DirectoryWriter(dest_folder)
+
+class ShardReader:
+    """ Random access to the samples written by ShardWriter, by index or by name """
+
+    def __init__(self, folder):
+        self.folder = folder
+        with open(os.path.join(folder, INDEX_FILENAME)) as file:
+            index = json.load(file)
+        self.shards = index['shards']
+        self.samples = index['samples']
+        self.names = {sample['name']: i for i, sample in enumerate(self.samples)}
+        self._fds = {}
+
+    def __len__(self):
+        return len(self.samples)
+
+    def _fd(self, shard):
+        if shard not in self._fds:
+            self._fds[shard] = os.open(os.path.join(self.folder, self.shards[shard]), os.O_RDONLY)
+        return self._fds[shard]
+
+    def __getitem__(self, i):
+        """ (name, encoded bytes) of sample i """
+        sample = self.samples[i]
+        return sample['name'], os.pread(self._fd(sample['shard']), sample['size'], sample['offset'])
+
+    def get(self, name):
+        return self[self.names[name]][1]
+
+    def read_image(self, i):
+        """ Decoded PIL image of sample i """
+        image = Image.open(io.BytesIO(self[i][1]))
+        image.load()
+        return image
+
+    def close(self):
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
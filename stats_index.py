@@ -0,0 +1,166 @@
+import os
+import sqlite3
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+from blownout import load_rgb_array, list_images
+from format_txt_for_ffmpeg import write_ffmpeg_list
+
+INDEX_FILENAME = 'image_stats.sqlite'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    draft_scale INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    mean REAL,
+    luma_hist BLOB,
+    min_hist BLOB
+)
+"""
+# Files that fail to decode get a row with NULL statistics, so they are not retried until they
+# change, and count as not blown out, like is_image_blowout in blownout.py does
+
+def compute_image_stats(image_path, draft_scale=1):
+    """
+    Decode an image once and compute the statistics stored in the index.
+    The histogram of the per-pixel minimum channel gives the white ratio for any
+    white_threshold: a pixel is white when all channels, i.e. its minimum, exceed it.
+    :return: Dict with width, height, mean, luma_hist and min_hist, or None on error.
+    """
+    try:
+        pixels = load_rgb_array(image_path, draft_scale)
+    except Exception as e:
+        print(f"Error processing {image_path}: {e}")
+        return None
+
+    if pixels.ndim == 3:
+        min_channel = pixels.min(axis=2)
+        # Same fixed point ITU-R 601-2 weights Pillow uses for convert('L')
+        rgb = pixels.astype(np.uint32)
+        luma = ((rgb[..., 0] * 19595 + rgb[..., 1] * 38470 + rgb[..., 2] * 7471 + 0x8000) >> 16).astype(np.uint8)
+    else:
+        min_channel = luma = pixels
+
+    luma_hist = np.bincount(luma.ravel(), minlength=256).astype('<u4')
+    min_hist = np.bincount(min_channel.ravel(), minlength=256).astype('<u4')
+    height, width = pixels.shape[:2]
+    return {
+        'width': width,
+        'height': height,
+        'mean': float(np.dot(np.arange(256), luma_hist) / luma.size),
+        'luma_hist': luma_hist.tobytes(),
+        'min_hist': min_hist.tobytes(),
+    }
+
+def white_ratios(min_hists, white_threshold):
+    """Percentage of white pixels for each row of an (n, 256) minimum channel histogram array."""
+    totals = min_hists.sum(axis=1)
+    white = min_hists[:, white_threshold + 1:].sum(axis=1)
+    return white / np.maximum(totals, 1) * 100
+
+class StatsIndex:
+    """
+    SQLite sidecar with per-image statistics, keyed by path relative to the source folder.
+    Entries are reused while the file size, mtime and draft_scale are unchanged.
+    """
+
+    def __init__(self, source_dir, index_path=None):
+        self.source_dir = source_dir
+        self.index_path = index_path or os.path.join(source_dir, INDEX_FILENAME)
+        self.connection = sqlite3.connect(self.index_path)
+        self.connection.execute(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def update(self, draft_scale=1, workers=None, chunksize=16):
+        """
+        Scan new or changed images in the source folder and drop entries for removed files.
+        :return: Number of images (re)scanned.
+        """
+        filenames = list_images(self.source_dir)
+        known = {path: (size, mtime_ns, scale) for path, size, mtime_ns, scale in
+                 self.connection.execute("SELECT path, size, mtime_ns, draft_scale FROM images")}
+
+        pending = []
+        for filename in filenames:
+            stat = os.stat(os.path.join(self.source_dir, filename))
+            key = (stat.st_size, stat.st_mtime_ns, draft_scale)
+            if known.get(filename) != key:
+                pending.append((filename, key))
+
+        removed = set(known) - set(filenames)
+        self.connection.executemany("DELETE FROM images WHERE path = ?", [(path,) for path in removed])
+
+        paths = [os.path.join(self.source_dir, filename) for filename, _ in pending]
+        compute = partial(compute_image_stats, draft_scale=draft_scale)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for (filename, (size, mtime_ns, scale)), stats in zip(pending, executor.map(compute, paths, chunksize=chunksize)):
+                # A file that no longer decodes must not keep its old statistics
+                stats = stats or dict.fromkeys(('width', 'height', 'mean', 'luma_hist', 'min_hist'))
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (filename, size, mtime_ns, scale, stats['width'], stats['height'], stats['mean'],
+                     stats['luma_hist'], stats['min_hist']))
+        self.connection.commit()
+        return len(pending)
+
+    def select_not_blown_out(self, white_threshold=230, blowout_percentage=20):
+        """
+        Sorted filenames whose white ratio at white_threshold does not exceed blowout_percentage.
+        Files that failed to decode are included, as blownout.py lists them.
+        """
+        rows = self.connection.execute("SELECT path, min_hist FROM images ORDER BY path").fetchall()
+        decoded = [row for row in rows if row[1] is not None]
+        if not decoded:
+            return [row[0] for row in rows]
+        min_hists = np.frombuffer(b''.join(row[1] for row in decoded), dtype='<u4').reshape(len(decoded), 256)
+        blown_out = white_ratios(min_hists.astype(np.int64), white_threshold) > blowout_percentage
+        excluded = set(row[0] for row, blown in zip(decoded, blown_out) if blown)
+        return [row[0] for row in rows if row[0] not in excluded]
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain a per-image statistics index and query it for blow-out thresholds.")
+    parser.add_argument('source_dir', type=str, help="Folder with images")
+    parser.add_argument('--index', type=str, default=None, help=f"Index file (default: <source_dir>/{INDEX_FILENAME})")
+    parser.add_argument('--white_threshold', type=int, default=230, help="Minimum value to consider a pixel white")
+    parser.add_argument('--blowout_percentage', type=float, default=20, help="Percentage of white pixels that counts as blown out")
+    parser.add_argument('--draft_scale', type=int, default=1, choices=[1, 2, 4, 8], help="Decode JPEGs at reduced resolution when scanning")
+    parser.add_argument('--workers', type=int, default=None, help="Number of worker processes (default: CPU count)")
+    parser.add_argument('--output_file', type=str, default=None, help="Output list (default: <source_dir>/not_blown_out_images.txt)")
+    parser.add_argument('--ffmpeg_file', type=str, default=None, help="Also write an ffmpeg concat list of the selected images")
+    parser.add_argument('--no_scan', action='store_true', help="Only query the existing index")
+
+    args = parser.parse_args()
+    with StatsIndex(args.source_dir, args.index) as index:
+        if not args.no_scan:
+            scanned = index.update(args.draft_scale, args.workers)
+            print(f"Scanned {scanned} new or changed images")
+
+        filenames = index.select_not_blown_out(args.white_threshold, args.blowout_percentage)
+
+    output_file = args.output_file or os.path.join(args.source_dir, 'not_blown_out_images.txt')
+    with open(output_file, 'w') as file:
+        for filename in filenames:
+            file.write(filename + '\n')
+    print(f"List of {len(filenames)} not blown out images saved to {output_file}")
+
+    if args.ffmpeg_file:
+        write_ffmpeg_list(filenames, args.ffmpeg_file)
+        print(f"Formatted filenames have been saved to {args.ffmpeg_file}")
+
+if __name__ == "__main__":
+    main()
+
+#python stats_index.py /Volumes/Solardisk/scraper_all_images_flat/boul-60-70 --white_threshold 220 --ffmpeg_file /Volumes/Solardisk/scraper_all_images_flat/boul-60-70/not_blown_out_images-ffmpeg.txt
@@ -1,9 +1,16 @@
+import io
 import os
+import zlib
 import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import cached_property, lru_cache, partial
 from PIL import Image
 import numpy as np
-from scipy import signal
-from scipy.ndimage import map_coordinates
+from scipy import fft, signal
+from scipy.ndimage import map_coordinates, uniform_filter
+from shards import open_writer
+from manifest import Manifest
 
 def load_image(image_path):
     return Image.open(image_path).convert('L')
@@ -29,89 +36,349 @@ def reduce_contrast(image, factor):
     adjusted_image = image.astype(np.float32) * factor + mid_gray * (1 - factor)
     return np.clip(adjusted_image, 0, 255)
 
-def apply_effects(image, kernel, amplitude, frequency, contrast_factor, enable_blur, enable_turbulence, enable_contrast):
-    image_np = np.array(image)
+class EffectPlan:
+    """ Cached sine warp coordinates and box blur for one shape, within one gray level of the signal.convolve/warp path """
 
+    def __init__(self, shape, amplitude, frequency, kernel_size):
+        self.shape = tuple(shape)
+        self.amplitude = amplitude
+        self.frequency = frequency
+        self.kernel_size = kernel_size
+
+    @cached_property
+    def coordinates(self):
+        """ (2, height, width) float32 sampling coordinates, 8 bytes per pixel, so only built when warping """
+        height, width = self.shape
+        rows = np.arange(height, dtype=np.float64)
+        cols = np.arange(width, dtype=np.float64)
+        # Same displacements as create_warp_matrix: the row offset varies along the
+        # columns and the column offset along the rows, so both are 1-D profiles
+        row_offset = self.amplitude * np.sin(2 * np.pi * self.frequency * cols / width)
+        col_offset = self.amplitude * np.sin(2 * np.pi * self.frequency * rows / height)
+
+        coordinates = np.empty((2, height, width), dtype=np.float32)
+        coordinates[0] = np.clip(rows[:, None] + row_offset[None, :], 0, height - 1)
+        coordinates[1] = np.clip(cols[None, :] + col_offset[:, None], 0, width - 1)
+        return coordinates
+
+    def blur(self, image_np):
+        """ Box blur with zero padding, equivalent to signal.convolve(..., mode='same') """
+        return uniform_filter(image_np.astype(np.float64), size=self.kernel_size, mode='constant', cval=0.0)
+
+    def warp(self, image_np):
+        """ Apply the precomputed sine warp """
+        return map_coordinates(image_np, self.coordinates, order=1, mode='reflect')
+
+@lru_cache(maxsize=8)
+def get_effect_plan(shape, amplitude, frequency, kernel_size):
+    """ Cached EffectPlan, shared by all same-sized frames in a folder """
+    return EffectPlan(shape, amplitude, frequency, kernel_size)
+
+@lru_cache(maxsize=8)
+def phase_screen_filter(shape, correlation_length):
+    """
+    Amplitude filter for the rfft2 of white noise giving a Kolmogorov-like
+    k^(-11/3) power spectrum, flattened below 1 / correlation_length pixels.
+    """
+    ky = np.fft.fftfreq(shape[0])[:, None]
+    kx = np.fft.rfftfreq(shape[1])[None, :]
+    k_squared = kx ** 2 + ky ** 2 + (1.0 / correlation_length) ** 2
+    spectrum = (k_squared ** (-11 / 12)).astype(np.float32)
+    # No constant term, the screens only move pixels relative to each other
+    spectrum[0, 0] = 0
+    return spectrum
+
+class TurbulenceGenerator:
+    """
+    Random phase-screen displacement fields for one frame shape.
+
+    apply() warps an already contrast adjusted and blurred frame, so that work
+    is shared by all variants. Fields are made and applied one variant at a
+    time, so memory does not grow with the number of variants. Results are
+    reproducible for a given rng seed.
+    """
+
+    def __init__(self, shape, amplitude, correlation_length=64):
+        self.shape = tuple(shape)
+        self.amplitude = amplitude
+        self.filter = phase_screen_filter(self.shape, correlation_length)
+        height, width = self.shape
+        self.rows = np.arange(height, dtype=np.float32)[:, None]
+        self.cols = np.arange(width, dtype=np.float32)[None, :]
+
+    def displacements(self, rng):
+        """ (2, height, width) float32 row and column displacements with an rms of amplitude pixels """
+        # scipy.fft stays in single precision without the temporaries of np.fft
+        spectrum = fft.rfft2(rng.standard_normal((2,) + self.shape, dtype=np.float32))
+        spectrum *= self.filter
+        fields = fft.irfft2(spectrum, s=self.shape, overwrite_x=True)
+        del spectrum
+        for field in fields:
+            rms = np.sqrt(np.vdot(field, field) / field.size)
+            field *= self.amplitude / max(rms, 1e-12)
+        return fields
+
+    def apply(self, image_np, count, rng):
+        """ Yield count warped versions of image_np, one at a time """
+        height, width = self.shape
+        for _ in range(count):
+            coordinates = self.displacements(rng)
+            coordinates[0] += self.rows
+            coordinates[1] += self.cols
+            np.clip(coordinates[0], 0, height - 1, out=coordinates[0])
+            np.clip(coordinates[1], 0, width - 1, out=coordinates[1])
+            yield map_coordinates(image_np, coordinates, order=1, mode='reflect')
+
+@lru_cache(maxsize=8)
+def get_turbulence_generator(shape, amplitude, correlation_length):
+    return TurbulenceGenerator(shape, amplitude, correlation_length)
+
+def blur_and_contrast(image_np, kernel, contrast_factor, enable_blur, enable_contrast, plan=None):
     if enable_contrast:
         image_np = reduce_contrast(image_np, contrast_factor)
 
     if enable_blur:
-        image_np = signal.convolve(image_np, kernel, mode='same')
+        if plan is not None:
+            image_np = plan.blur(image_np)
+        else:
+            image_np = signal.convolve(image_np, kernel, mode='same')
+    return image_np
+
+def apply_effects(image, kernel, amplitude, frequency, contrast_factor, enable_blur, enable_turbulence, enable_contrast, plan=None):
+    image_np = blur_and_contrast(np.array(image), kernel, contrast_factor, enable_blur, enable_contrast, plan)
 
     if enable_turbulence:
-        warp_matrix = create_warp_matrix(image.size, amplitude, frequency)
-        image_np = warp(image_np, warp_matrix)
+        if plan is not None:
+            image_np = plan.warp(image_np)
+        else:
+            warp_matrix = create_warp_matrix(image.size, amplitude, frequency)
+            image_np = warp(image_np, warp_matrix)
 
     return Image.fromarray(image_np.astype(np.uint8))
 
+def tile_positions(length, tile_size, stride, edge):
+    """ Tile start offsets along one axis, and the axis length the tiles are cut from """
+    if edge == 'drop':
+        return list(range(0, length - tile_size + 1, stride)), length
+    count = max(0, -(-(length - tile_size) // stride)) + 1
+    covered = tile_size + (count - 1) * stride
+    # 'resize' stretches the image to exactly the covered length, 'pad' and 'reflect' extend the last tiles
+    return [i * stride for i in range(count)], covered if edge == 'resize' else length
+
+def iter_tiles(image_np, tile_size=256, stride=None, edge='resize', min_content=0.0, black_level=10):
+    """
+    Lazily yield (idx, tile) from a 2-D (or 2-D + channels) array.
+
+    Tiles are views into one array; only tiles crossing the border with 'pad' are
+    copied, and 'reflect' pads a mirrored copy of the whole image once, so border tiles
+    continue the image instead of repeating their own strip. idx numbers the full grid
+    column by column, as resize_and_tile does, so skipped tiles don't shift the names of the others.
+    :param stride: Step between tiles, smaller than tile_size for overlap. Default tile_size.
+    :param edge: 'resize' (LANCZOS resize the image so the grid fits, the original behaviour),
+                 'pad' (zero pad), 'reflect' (mirror the image) or 'drop' (skip partial tiles).
+    :param min_content: Skip tiles where less than this fraction of pixels is above black_level,
+                        e.g. the corners masked by blockblack.py.
+    """
+    stride = stride or tile_size
+    height, width = image_np.shape[:2]
+    xs, new_width = tile_positions(width, tile_size, stride, edge)
+    ys, new_height = tile_positions(height, tile_size, stride, edge)
+    if edge == 'resize' and (new_width, new_height) != (width, height):
+        image_np = np.asarray(Image.fromarray(image_np).resize((new_width, new_height), Image.Resampling.LANCZOS))
+    elif edge == 'reflect' and xs and ys:
+        # Mirror the image at its border, not the partial tile's own pixels
+        padding = [(0, max(0, ys[-1] + tile_size - height)), (0, max(0, xs[-1] + tile_size - width))]
+        image_np = np.pad(image_np, padding + [(0, 0)] * (image_np.ndim - 2), mode='reflect')
+
+    idx = 0
+    for x in xs:
+        for y in ys:
+            tile = image_np[y:y + tile_size, x:x + tile_size]
+            if tile.shape[:2] != (tile_size, tile_size):
+                padding = [(0, tile_size - tile.shape[0]), (0, tile_size - tile.shape[1])] + [(0, 0)] * (tile.ndim - 2)
+                tile = np.pad(tile, padding, mode='constant')
+            if min_content <= 0 or np.count_nonzero(tile > black_level) >= min_content * tile.shape[0] * tile.shape[1]:
+                yield idx, tile
+            idx += 1
+
 def resize_and_tile(image, tile_size=256):
-    width, height = image.size
-    new_width = ((width - 1) // tile_size + 1) * tile_size
-    new_height = ((height - 1) // tile_size + 1) * tile_size
-    resized_image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-
-    tiles = []
-    for i in range(0, new_width, tile_size):
-        for j in range(0, new_height, tile_size):
-            tile = resized_image.crop((i, j, i + tile_size, j + tile_size))
-            tiles.append(tile)
-    return tiles
+    return [Image.fromarray(tile) for _, tile in iter_tiles(np.asarray(image), tile_size)]
 
 def convert_to_color(image):
     color_image = Image.merge("RGB", (image, image, image))
     return color_image
 
-def process_folder(args):
+def encode_image(image, filename, quality=100):
+    """ Encode an image in the format implied by filename's extension """
+    buffer = io.BytesIO()
+    image_format = Image.registered_extensions()[os.path.splitext(filename)[1].lower()]
+    image.save(buffer, format=image_format, quality=quality)
+    return buffer.getvalue()
+
+def render_outputs(image, filename, args, limit=float('inf')):
+    """
+    Process and encode the outputs of one decoded grayscale image.
+    Returns a list of (output filename, encoded bytes) with at most limit entries.
+    """
+    outputs = []
+    stem, ext = os.path.splitext(filename)
+    processed_images = render_variants(image, filename, args)
+    for variant, processed_image in enumerate(processed_images):
+        # A single variant keeps the original names
+        prefix = f"{stem}_v{variant}" if len(processed_images) > 1 else stem
+        if args.tile:
+            tiles = iter_tiles(np.asarray(processed_image), args.tile_size, args.stride, args.edge, args.min_content)
+            for idx, tile in tiles:
+                if len(outputs) >= limit:
+                    return outputs
+                save_name = f"{prefix}_tile{idx}.jpg"
+                tile = Image.fromarray(tile)
+                tile_to_save = convert_to_color(tile) if args.colorize else tile
+                outputs.append((save_name, encode_image(tile_to_save, save_name, args.quality)))
+        else:
+            if len(outputs) >= limit:
+                return outputs
+            save_name = prefix + ext
+            processed_image = convert_to_color(processed_image) if args.colorize else processed_image
+            outputs.append((save_name, encode_image(processed_image, save_name, args.quality)))
+    return outputs
+
+def render_variants(image, filename, args):
+    """
+    The processed images for one decoded frame: one with the sine warp (which
+    is the same every time), or args.variants random phase-screen warps of the
+    same contrast adjusted and blurred frame.
+    """
     kernel = np.ones((args.kernel_size, args.kernel_size)) / (args.kernel_size ** 2)
+    shape = (image.height, image.width)
+    # Frames without blur or warp need no plan, and nothing is cached for their size
+    plan = None
+    if args.enable_blur or args.enable_turbulence:
+        plan = get_effect_plan(shape, args.amplitude, args.frequency, args.kernel_size)
+    if args.turbulence_model == 'sine' or not args.enable_turbulence:
+        processed_image = apply_effects(image, kernel, args.amplitude, args.frequency, args.contrast_factor, args.enable_blur, args.enable_turbulence, args.enable_contrast, plan)
+        return [processed_image]
+
+    image_np = blur_and_contrast(np.array(image), kernel, args.contrast_factor, args.enable_blur, args.enable_contrast, plan)
+    # Seeded per file, so the output does not depend on which worker renders it
+    rng = np.random.default_rng(None if args.seed is None else [args.seed, zlib.crc32(filename.encode())])
+    generator = get_turbulence_generator(shape, args.amplitude, args.correlation_length)
+    return [Image.fromarray(warped.astype(np.uint8)) for warped in generator.apply(image_np, args.variants, rng)]
+
+def render_image(args, filename, limit=float('inf')):
+    """ Decode one source image and render its outputs """
+    image = load_image(os.path.join(args.source_folder, filename))
+    return render_outputs(image, filename, args, limit)
+
+def iter_rendered(filenames, render, limit, workers=1):
+    """
+    Yield render(filename, limit()) for each file, in input order.
+    With workers > 1 files are rendered on a process pool with at most
+    2 * workers files in flight, so memory stays bounded when the consumer is slow.
+    render must be picklable, e.g. a partial of a module level function.
+    """
+    if workers <= 1:
+        for filename in filenames:
+            yield render(filename, limit())
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        remaining = iter(filenames)
+        try:
+            while True:
+                while len(pending) < 2 * workers:
+                    filename = next(remaining, None)
+                    if filename is None:
+                        break
+                    pending.append(executor.submit(render, filename, limit()))
+                if not pending:
+                    return
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+def check_args(args):
+    """ Reject option combinations whose effect would silently be dropped """
+    if args.variants < 1:
+        raise ValueError("--variants must be at least 1")
+    if args.variants > 1 and not (args.enable_turbulence and args.turbulence_model == 'phase_screen'):
+        raise ValueError("--variants needs --enable_turbulence and --turbulence_model phase_screen, "
+                         "the sine warp renders one output per image")
 
-    if not os.path.exists(args.dest_folder):
-        os.makedirs(args.dest_folder)
-
-    tile_count = 0
-    for filename in sorted(os.listdir(args.source_folder)):
-        if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')):
-            image_path = os.path.join(args.source_folder, filename)
-            image = load_image(image_path)
-
-            processed_image = apply_effects(image, kernel, args.amplitude, args.frequency, args.contrast_factor, args.enable_blur, args.enable_turbulence, args.enable_contrast)
-            
-            if args.tile:
-                tiles = resize_and_tile(processed_image)
-                for idx, tile in enumerate(tiles):
-                    if tile_count >= args.max_tiles:
-                        print(f"Generated {tile_count} tiles, stopping as per limit.")
-                        return
-
-                    save_path = os.path.join(args.dest_folder, f"{os.path.splitext(filename)[0]}_tile{idx}.jpg")
-                    tile_to_save = convert_to_color(tile) if args.colorize else tile
-                    tile_to_save.save(save_path, quality=100)
-                    tile_count += 1
+def process_folder(args):
+    check_args(args)
+    filenames = [filename for filename in sorted(os.listdir(args.source_folder))
+                 if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff'))]
+
+    # Shards are rewritten on every run, only per-file output can resume
+    resume = args.resume and not args.shard_size
+    params = {key: value for key, value in vars(args).items()
+              if key not in ('source_folder', 'dest_folder', 'max_tiles', 'workers', 'shard_size', 'resume', 'use_hash')}
+    with open_writer(args.dest_folder, args.shard_size) as writer, Manifest(args.dest_folder, params, args.use_hash) as manifest:
+        up_to_date = {filename for filename in filenames
+                      if resume and manifest.is_up_to_date(os.path.join(args.source_folder, filename))}
+
+        # One output past the remaining limit lets the loop see that the limit was hit
+        tile_count = 0
+        limit = lambda: args.max_tiles - tile_count + 1
+        rendered = iter_rendered([filename for filename in filenames if filename not in up_to_date],
+                                 partial(render_image, args), limit, args.workers)
+
+        # Outputs are written here, in input order, so the limit is exact with any number of workers
+        for filename in filenames:
+            if filename in up_to_date:
+                # Outputs from a previous run count towards the limit as if they were written now
+                outputs = [(save_name, None) for save_name in manifest.outputs(os.path.join(args.source_folder, filename))]
             else:
+                outputs = next(rendered)
+
+            for save_name, data in outputs:
                 if tile_count >= args.max_tiles:
-                    print(f"Generated {tile_count} files, stopping as per limit.")
+                    print(f"Generated {tile_count} {'tiles' if args.tile else 'files'}, stopping as per limit.")
                     return
 
-                save_path = os.path.join(args.dest_folder, filename)
-                processed_image = convert_to_color(processed_image) if args.colorize else processed_image
-                processed_image.save(save_path, quality=100)
+                if data is not None:
+                    writer.write(save_name, data)
                 tile_count += 1
 
-if __name__ == "__main__":
+            # Only images whose outputs were all written are complete; a render cut
+            # short by the limit is always followed by the return above
+            if filename not in up_to_date and not args.shard_size:
+                manifest.record(os.path.join(args.source_folder, filename), [save_name for save_name, _ in outputs])
+
+def build_parser():
     parser = argparse.ArgumentParser(description="Process images with optional effects.")
     parser.add_argument("source_folder", type=str, help="Source folder path")
     parser.add_argument("dest_folder", type=str, help="Destination folder path")
     parser.add_argument("--kernel_size", type=int, default=5, help="Size of the blur kernel")
-    parser.add_argument("--amplitude", type=float, default=2, help="Amplitude for warp matrix")
+    parser.add_argument("--amplitude", type=float, default=2, help="Amplitude for warp matrix, rms displacement in pixels for phase-screen warps")
     parser.add_argument("--frequency", type=float, default=10, help="Frequency for warp matrix")
     parser.add_argument("--contrast_factor", type=float, default=0.5, help="Contrast factor")
     parser.add_argument("--tile", action="store_true", help="Enable tiling of images")
+    parser.add_argument("--turbulence_model", type=str, default='sine', choices=['sine', 'phase_screen'], help="Fixed sine warp or random phase-screen warps")
+    parser.add_argument("--variants", type=int, default=1, help="Number of turbulent versions rendered from each image")
+    parser.add_argument("--correlation_length", type=float, default=64, help="Correlation length in pixels of the phase-screen warps")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for the phase-screen warps")
+    parser.add_argument("--tile_size", type=int, default=256, help="Size of the square tiles")
+    parser.add_argument("--stride", type=int, default=None, help="Step between tiles, smaller than tile_size for overlapping tiles")
+    parser.add_argument("--edge", type=str, default='resize', choices=['resize', 'pad', 'reflect', 'drop'], help="How to tile images that are not a multiple of the tile grid")
+    parser.add_argument("--min_content", type=float, default=0.0, help="Skip tiles with less than this fraction of non-black pixels")
     parser.add_argument("--colorize", action="store_true", help="Convert grayscale to color")
     parser.add_argument("--enable_blur", action="store_true", help="Enable blurring effect")
     parser.add_argument("--enable_turbulence", action="store_true", help="Enable turbulence effect")
     parser.add_argument("--enable_contrast", action="store_true", help="Enable contrast adjustment")
     parser.add_argument("--max_tiles", type=int, default=float('inf'), help="Maximum number of tiles to generate")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes")
+    parser.add_argument("--quality", type=int, default=100, help="JPEG quality of the saved images")
+    parser.add_argument("--shard_size", type=int, default=None, help="Write tar shards of this many files with an index instead of one file each")
+    parser.add_argument("--no_resume", dest="resume", action="store_false", help="Reprocess images even if their outputs are up to date")
+    parser.add_argument("--use_hash", action="store_true", help="Compare input contents, not only size and mtime, when resuming")
+    return parser
 
-    args = parser.parse_args()
+if __name__ == "__main__":
+    args = build_parser().parse_args()
     process_folder(args)
 
 #python turbulence_emulation.py /Users/espensommereide/Developer/solar-dataset/solar-big-bear-black /Users/espensommereide/Developer/solar-dataset/solar-tiles2 --kernel_size 5 --amplitude 2 --frequency 10 --contrast_factor 0.5 --tile --colorize --apply_effects --max_tiles 5500